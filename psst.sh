@@ -14,18 +14,26 @@ description() {
 
 usage() { 
 	BASENAME=`basename "$0"`
-	printf "Usage: ${BASENAME} [-h description and usage] [-s SRA accessions] [-n SNP accessions]\n"
+	printf "Usage: ${BASENAME} [-h description and usage] [-s SRA accessions] [-n SNP accessions or panel bundle]\n"
     printf "               [-f FASTQ file] [-d working directory] [-e email for Entrez]\n"
     printf "               [-t threads] [-p max number of child processes]\n"
+    printf "               [-P profiler for the Python stages, either 'cprofile' or 'sample']\n"
+    printf "               [-F result format, one of 'tsv', 'jsonl' or 'parquet'] [-S sort the results]\n"
+    printf "               [-r working directory of a previous run whose SNP reference should be reused]\n"
+    printf "               [-c collapse identical reads before alignment, for single-end data only]\n"
+    printf "               [-D stop aligning a dataset once every SNP call is settled at this read depth]\n"
+    printf "               [-b align small SRA datasets together in batches of at most this many bytes]\n"
     echo ""
     echo "Notes:"
-    echo "'-h' is the only non-mandatory parameter."
+    echo "'-h', '-P', '-F', '-S', '-c', '-D' and '-b' are the only non-mandatory parameters."
+    echo "With '-r', the SNP reference is not rebuilt, so '-n' and '-e' are not needed."
+    echo "'-n' also accepts a SNP panel bundle built by src/panel.py, which is used like '-r'."
     echo "Exactly one of '-s' or '-f' must be provided as an argument."
     echo "All other arguments are mandatory."
 }
 
 # Command line arguments
-while getopts ":hs:f:n:d:e:t:p:" opt; do
+while getopts ":hScs:f:n:d:e:t:p:P:F:r:D:b:" opt; do
     case ${opt} in
         h)
             description 
@@ -38,7 +46,7 @@ while getopts ":hs:f:n:d:e:t:p:" opt; do
         f) # path to FASTQ file
             FASTQ=${OPTARG}
             ;;
-        n) # path to the SNP accessions file
+        n) # path to the SNP accessions file or to a SNP panel bundle
             SNP_ACC=${OPTARG}
             ;;
         d) # path to the working directory
@@ -53,6 +61,27 @@ while getopts ":hs:f:n:d:e:t:p:" opt; do
         p) # maximum number of child processes
             PROCS=${OPTARG}
             ;;
+        P) # profiler to run the Python stages under
+            PROFILE=${OPTARG}
+            ;;
+        F) # format of the result file
+            FORMAT=${OPTARG}
+            ;;
+        S) # sort the results by accession
+            SORT="-S"
+            ;;
+        r) # working directory of a previous run containing a prebuilt SNP reference
+            REF=${OPTARG}
+            ;;
+        c) # collapse identical reads into one weighted read before alignment
+            COLLAPSE=1
+            ;;
+        D) # number of spanning reads per SNP after which the alignment of a dataset may stop
+            STOP_DEPTH=${OPTARG}
+            ;;
+        b) # maximum total size in bytes of the SRA datasets aligned by a single Magic-BLAST run
+            BATCH_BYTES=${OPTARG}
+            ;;
         \?)
             echo "Invalid option: -${OPTARG}" >&2
             exit 1
@@ -69,15 +98,31 @@ if [ ! -z "${SRA_ACC}" ] && [ ! -z "${FASTQ}" ]; then
     echo "Error: please provide only one of either an SRA accessions file or a FASTQ file."
     OPTS_INCOMPLETE=0
 fi
-if [ -z "${SNP_ACC}" ]; then
+if [ -n "${SNP_ACC}" ] && [ -d "${SNP_ACC}" ]; then
+    # A SNP panel bundle built by src/panel.py may be given in place of the SNP accessions file
+    if [ ! -f "${SNP_ACC}/panel.json" ]; then
+        echo "Error: ${SNP_ACC} is not a SNP panel bundle built by src/panel.py."
+        OPTS_INCOMPLETE=0
+    elif [ -n "${REF}" ]; then
+        echo "Error: please provide only one of either a SNP panel bundle or a reference directory."
+        OPTS_INCOMPLETE=0
+    else
+        REF=${SNP_ACC}
+    fi
+fi
+if [ -z "${SNP_ACC}" ] && [ -z "${REF}" ]; then
     echo "Error: please provide a SNP accessions file."
     OPTS_INCOMPLETE=0
 fi
+if [ -n "${REF}" ] && [ ! -f "${REF}/snp_info.txt" -o ! -f "${REF}/snp_flanks.fasta" ]; then
+    echo "Error: ${REF} does not contain a SNP reference built by a previous run."
+    OPTS_INCOMPLETE=0
+fi
 if [ -z "${DIR}" ]; then
     echo "Error: please specify a working directory."
     OPTS_INCOMPLETE=0
 fi
-if [ -z "${EMAIL}" ]; then
+if [ -z "${EMAIL}" ] && [ -z "${REF}" ]; then
     echo "Error: please provide an email address for Entrez."
     OPTS_INCOMPLETE=0
 fi
@@ -89,6 +134,28 @@ if [ -z "${PROCS}" ]; then
     echo "Error: please specify the maximum number of child processes for this program."
     OPTS_INCOMPLETE=0
 fi
+if [ -n "${PROFILE}" ] && [ "${PROFILE}" != "cprofile" ] && [ "${PROFILE}" != "sample" ]; then
+    echo "Error: the profiler must be either 'cprofile' or 'sample'."
+    OPTS_INCOMPLETE=0
+fi
+if [ -z "${FORMAT}" ]; then
+    FORMAT=tsv
+elif [ "${FORMAT}" != "tsv" ] && [ "${FORMAT}" != "jsonl" ] && [ "${FORMAT}" != "parquet" ]; then
+    echo "Error: the result format must be one of 'tsv', 'jsonl' or 'parquet'."
+    OPTS_INCOMPLETE=0
+fi
+if [ -n "${STOP_DEPTH}" ] && ! [[ "${STOP_DEPTH}" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: the read depth must be a positive integer."
+    OPTS_INCOMPLETE=0
+fi
+if [ -n "${STOP_DEPTH}" ] && [ -n "${COLLAPSE}" ]; then
+    echo "Error: '-D' cannot be combined with '-c'."
+    OPTS_INCOMPLETE=0
+fi
+if [ -n "${BATCH_BYTES}" ] && ! [[ "${BATCH_BYTES}" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: the batch size must be a positive number of bytes."
+    OPTS_INCOMPLETE=0
+fi
 # Exit the script if the command line options are incomplete or incorrect
 if [ -n "${OPTS_INCOMPLETE}" ]; then
     echo ""
@@ -99,45 +166,83 @@ fi
 ## Retrieve the command line arguments and set up directories, paths
 mkdir -p ${DIR} # If the working directory does not exist, create it
 SRC=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )/src
-export BLASTDB=${DIR}
+if [ -n "${REF}" ]; then
+    REF=$( cd "${REF}" && pwd )
+    export BLASTDB=${REF}
+else
+    export BLASTDB=${DIR}
+fi
 
-## Find the variant flanking sequences
-echo "Finding SNP flanking sequences..."
-SNP_FLANKS=${DIR}/snp_flanks.txt
-${SRC}/get_var_flanks.py -i ${SNP_ACC} -e ${EMAIL} -o ${SNP_FLANKS}
+## Every stage records its wall time, CPU time, peak memory and counters in the report directory. The records
+## are merged into a single JSON report at the end of the run.
+export PSST_REPORT_DIR=${DIR}/report
+rm -rf ${PSST_REPORT_DIR} # Discard the records of previous runs
+mkdir -p ${PSST_REPORT_DIR}
+if [ -n "${PROFILE}" ]; then
+    export PSST_PROFILE=${PROFILE}
+fi
+RUN_REPORT=${DIR}/run_report.json
 
-## Get the variant information, i.e. the start and stop positions of the major allele variant in the flanking sequence
-## and the length of the major allele
-echo "Getting SNP flank information..."
-SNP_INFO=${DIR}/snp_info.txt
-${SRC}/find_var_info.py -i ${SNP_FLANKS} -o ${SNP_INFO} 
+if [ -n "${REF}" ]; then
+    ## Reuse the SNP reference of a previous run, e.g. one shared by all the shards of a cohort
+    echo "Using the SNP reference in ${REF}..."
+    SNP_INFO=${REF}/snp_info.txt
+    SNP_FASTA=${REF}/snp_flanks.fasta
+else
+    ## Find the variant flanking sequences
+    echo "Finding SNP flanking sequences..."
+    SNP_FLANKS=${DIR}/snp_flanks.txt
+    ${SRC}/get_var_flanks.py -i ${SNP_ACC} -e ${EMAIL} -o ${SNP_FLANKS}
 
-## Construct a FASTA file out of the variant flanking sequence file
-echo "Constructing FASTA file out of the SNP flanking sequences..."
-SNP_FASTA=${DIR}/snp_flanks.fasta
-${SRC}/var_flanks_to_fasta.py -i ${SNP_FLANKS} -o ${SNP_FASTA}
+    ## Get the variant information, i.e. the start and stop positions of the major allele variant in the flanking
+    ## sequence and the length of the major allele
+    echo "Getting SNP flank information..."
+    SNP_INFO=${DIR}/snp_info.txt
+    ${SRC}/find_var_info.py -i ${SNP_FLANKS} -o ${SNP_INFO} 
 
-## Create a BLAST database out of the variant FASTA file
-echo "Creating a BLAST database out of the SNP flanks FASTA file..."
-${SRC}/makeblastdb.sh ${SNP_FASTA} ${DIR}
+    ## Construct a FASTA file out of the variant flanking sequence file
+    echo "Constructing FASTA file out of the SNP flanking sequences..."
+    SNP_FASTA=${DIR}/snp_flanks.fasta
+    ${SRC}/var_flanks_to_fasta.py -i ${SNP_FLANKS} -o ${SNP_FASTA}
+
+    ## Create a BLAST database out of the variant FASTA file
+    echo "Creating a BLAST database out of the SNP flanks FASTA file..."
+    ${SRC}/run_report.py -r ${PSST_REPORT_DIR} -n makeblastdb -- ${SRC}/makeblastdb.sh ${SNP_FASTA} ${DIR}
+fi
 
 ## Align the SRA datasets onto the variants (a la the BLAST database) using Magic-BLAST
 echo "Aligning SRA datasets onto the SNPs..."
 MBO_DIR=${DIR}/mbo # We will store the .mbo files here
 mkdir -p ${MBO_DIR} # Create the directory if it doesn't exist yet
+if [ -n "${STOP_DEPTH}" ]; then
+    # The Magic-BLAST scripts pipe the alignments through early_stop.py, which stops the alignment of a dataset
+    # once the call of every SNP is the one it would have after STOP_DEPTH spanning reads
+    export PSST_STOP_DEPTH=${STOP_DEPTH}
+    export PSST_SNP_INFO=${SNP_INFO}
+    export PSST_SNP_FASTA=${SNP_FASTA}
+    TRUNCATED="-T" # Say in the TSV results which datasets were stopped early
+fi
+if [ -n "${BATCH_BYTES}" ]; then
+    # Small datasets are packed into batches, each aligned by a single Magic-BLAST run, see batch_sra.py
+    export PSST_BATCH_BYTES=${BATCH_BYTES}
+fi
 
 # Either run Magic-BLAST on list of SRA accessions or on the single FASTQ file
 if [ -n "${SRA_ACC}" ]; then
-    ${SRC}/magicblast_sra.sh ${SRA_ACC} snp_flanks ${MBO_DIR} ${THREADS} ${PROCS}
+    ${SRC}/magicblast_sra.sh ${SRA_ACC} snp_flanks ${MBO_DIR} ${THREADS} ${PROCS} ${COLLAPSE:-0}
 else
-    ${SRC}/magicblast_fastq.sh ${FASTQ} snp_flanks ${MBO_DIR} ${THREADS}
+    ${SRC}/magicblast_fastq.sh ${FASTQ} snp_flanks ${MBO_DIR} ${THREADS} ${COLLAPSE:-0}
 fi
 
 ## Call variants in the SRA datasets
 echo "Calling SNPs..."
-TSV=${DIR}/results.tsv
+RESULTS=${DIR}/results.${FORMAT}
 declare -i COMBINED_PROCS
 COMBINED_PROCS=${THREADS}*${PROCS}
-${SRC}/call_variants.py -m ${MBO_DIR} -v ${SNP_INFO} -f ${SNP_FASTA} -p ${COMBINED_PROCS} -o ${TSV}
+${SRC}/call_variants.py -m ${MBO_DIR} -v ${SNP_INFO} -f ${SNP_FASTA} -p ${COMBINED_PROCS} -o ${RESULTS} \
+    -F ${FORMAT} ${SORT} ${TRUNCATED} -C ${DIR}/variant_counts.tsv -M ${DIR}/variant_matrix.tsv -E ${DIR}/evidence.tsv.gz
+${SRC}/run_report.py -r ${PSST_REPORT_DIR} -m ${RUN_REPORT}
 echo "PSST run complete. Result file can be found at:"
-echo ${TSV}
+echo ${RESULTS}
+echo "The run report can be found at:"
+echo ${RUN_REPORT}
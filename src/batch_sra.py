@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import getopt
+import re
+import subprocess
+import sys
+from multiprocessing.dummy import Pool
+
+# Global variables are depicted in all uppercase
+BATCH_BYTES_VAR = 'PSST_BATCH_BYTES' # Environment variable that makes magicblast_sra.sh align datasets in batches
+BATCH_BYTES = 1000000000 # Default maximum total size of the datasets of a batch, in bytes
+MAX_BATCH_ACCESSIONS = 200 # Maximum number of datasets in a batch, which keeps the Magic-BLAST command line short
+BATCH_NAME = 'batch_%04d' # Name of the Magic-BLAST output of a batch of several datasets
+SIZE_PATTERN = re.compile(r'^size\s*:\s*([\d,]+)\s*$',re.MULTILINE)
+
+# Every Magic-BLAST run loads the BLAST database and starts its threads, which dominates the run time of small
+# targeted-sequencing datasets. This script packs such datasets into batches that magicblast_sra.sh aligns with a
+# single Magic-BLAST run. Magic-BLAST names the reads of an SRA dataset after its accession, which call_variants.py
+# uses to split the output of a batch back into datasets.
+
+def get_dataset_size(accession):
+    '''
+    Looks up the size of an SRA dataset with vdb-dump from the SRA Toolkit
+    Inputs
+    - (str) accession: the SRA accession
+    Outputs
+    - (int) the size of the dataset in bytes, or None if it could not be determined
+    '''
+    try:
+        output = subprocess.check_output(['vdb-dump','--info',accession],stderr=subprocess.STDOUT)
+    except (OSError,subprocess.CalledProcessError):
+        return None
+    match = SIZE_PATTERN.search( output.decode('utf-8','replace') )
+    if match is None:
+        return None
+    return int( match.group(1).replace(',','') )
+
+def read_sizes(path):
+    '''
+    Reads a file of dataset sizes where each line holds an SRA accession and its size in bytes, e.g. the Run and
+    Bytes columns of the SRA Run Selector
+    Outputs
+    - sizes: a dict where the keys are SRA accessions and the values are sizes
+    '''
+    sizes = {}
+    with open(path,'r') as in_stream:
+        for line in in_stream:
+            tokens = line.split()
+            if len(tokens) >= 2 and tokens[1].isdigit():
+                sizes[tokens[0]] = int(tokens[1])
+    return sizes
+
+def get_dataset_sizes(accessions,sizes=None,threads=1):
+    '''
+    Determines the size of every dataset, looking up with vdb-dump those that are not in sizes
+    Inputs
+    - accessions: the list of SRA accessions
+    - sizes: optional dict of known sizes, see read_sizes
+    - (int) threads: number of concurrent lookups
+    Outputs
+    - a dict where the keys are SRA accessions and the values are sizes in bytes, or None if unknown
+    '''
+    if sizes is None:
+        sizes = {}
+    unknown = [accession for accession in accessions if accession not in sizes]
+    dataset_sizes = dict( [(accession,sizes[accession]) for accession in accessions if accession in sizes] )
+    if len(unknown) > 0:
+        pool = Pool(processes=max(1,min(threads,len(unknown))))
+        dataset_sizes.update( zip(unknown,pool.map(get_dataset_size,unknown)) )
+        pool.close()
+        pool.join()
+    return dataset_sizes
+
+def plan_batches(accessions,dataset_sizes,max_bytes=BATCH_BYTES,max_accessions=MAX_BATCH_ACCESSIONS):
+    '''
+    Packs the datasets into batches whose total size is at most max_bytes. Datasets that are at least half of
+    max_bytes, or whose size is unknown, are aligned on their own.
+    Inputs
+    - accessions: the list of SRA accessions
+    - dataset_sizes: a dict where the keys are SRA accessions and the values are sizes in bytes or None
+    - (int) max_bytes: maximum total size of the datasets of a batch
+    - (int) max_accessions: maximum number of datasets in a batch
+    Outputs
+    - batches: a list of pairs where the first entry is the name of the Magic-BLAST output, either the accession
+               of a dataset aligned on its own or a BATCH_NAME, and the second is the list of accessions
+    '''
+    batches = []
+    small = []
+    for accession in accessions:
+        size = dataset_sizes.get(accession)
+        if size is None or 2 * size >= max_bytes:
+            batches.append( (accession,[accession]) )
+        else:
+            small.append( (size,accession) )
+    # Packing the largest datasets first leaves the least room unused
+    small.sort(key=lambda pair: (-pair[0],pair[1]))
+    open_batches = [] # Pairs of total size and list of accessions
+    for size, accession in small:
+        for batch in open_batches:
+            if batch[0] + size <= max_bytes and len(batch[1]) < max_accessions:
+                batch[0] += size
+                batch[1].append(accession)
+                break
+        else:
+            open_batches.append( [size,[accession]] )
+    num_batches = 0
+    for batch in open_batches:
+        if len(batch[1]) == 1:
+            batches.append( (batch[1][0],batch[1]) )
+        else:
+            batches.append( (BATCH_NAME % (num_batches),sorted(batch[1])) )
+            num_batches += 1
+    return batches
+
+def write_batches(batches,output_path):
+    '''
+    Writes one batch per line: the name of its Magic-BLAST output, then its accessions separated by commas
+    '''
+    with open(output_path,'w') as out_stream:
+        for name, accessions in batches:
+            out_stream.write( "%s\t%s\n" % (name,','.join(accessions)) )
+
+def unit_tests():
+    sizes = {'SRR1':10,'SRR2':60,'SRR3':30,'SRR4':45,'SRR5':None}
+    batches = plan_batches(['SRR1','SRR2','SRR3','SRR4','SRR5'],sizes,max_bytes=100)
+    assert( batches == [('SRR2',['SRR2']),('SRR5',['SRR5']),('batch_0000',['SRR1','SRR3','SRR4'])] )
+    batches = plan_batches(['SRR1','SRR3','SRR4'],sizes,max_bytes=100,max_accessions=2)
+    assert( batches == [('batch_0000',['SRR3','SRR4']),('SRR1',['SRR1'])] )
+    assert( plan_batches([],{}) == [] )
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    help_message = "Description: Given a file of SRA accessions, packs small datasets into batches that are aligned\n" \
+                 + "             by a single Magic-BLAST run, based on the size of each dataset."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-i <SRA accessions file>]\n" % (sys.argv[0]) \
+                  + "[-o <output path for the batches>]\n" \
+                  + "[-b <max total bytes per batch, default %d>]\n" % (BATCH_BYTES) \
+                  + "[-n <max datasets per batch, default %d>]\n" % (MAX_BATCH_ACCESSIONS) \
+                  + "[-z <file of accessions and sizes in bytes; others are looked up with vdb-dump>]\n" \
+                  + "[-p <number of concurrent size lookups>]\n[-t <unit tests>]"
+    options = "hti:o:b:n:z:p:"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    if len(sys.argv) == 1:
+        print(help_message)
+        print(usage_message)
+        sys.exit()
+
+    sra_path = None
+    output_path = None
+    max_bytes = BATCH_BYTES
+    max_accessions = MAX_BATCH_ACCESSIONS
+    sizes_path = None
+    threads = 1
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-i':
+            sra_path = arg
+        elif opt == '-o':
+            output_path = arg
+        elif opt == '-b':
+            max_bytes = int(arg)
+        elif opt == '-n':
+            max_accessions = int(arg)
+        elif opt == '-z':
+            sizes_path = arg
+        elif opt == '-p':
+            threads = int(arg)
+        elif opt == '-t':
+            unit_tests()
+            sys.exit(0)
+
+    opts_incomplete = False
+
+    if sra_path == None:
+        print("Error: please provide the path to the SRA accessions file.")
+        opts_incomplete = True
+    if output_path == None:
+        print("Error: please provide an output path for the batches.")
+        opts_incomplete = True
+    if opts_incomplete:
+        print(usage_message)
+        sys.exit(1)
+
+    accessions = []
+    with open(sra_path,'r') as in_stream:
+        for line in in_stream:
+            accession = line.strip()
+            if len(accession) > 0:
+                accessions.append(accession)
+    sizes = None
+    if sizes_path != None:
+        sizes = read_sizes(sizes_path)
+    batches = plan_batches(accessions,get_dataset_sizes(accessions,sizes,threads),max_bytes,max_accessions)
+    write_batches(batches,output_path)
@@ -4,10 +4,20 @@ from __future__ import division # This modifies Python 2.7 so that any expressio
 import getopt
 import sys
 import os
-from itertools import combinations
+from itertools import chain, combinations
 from multiprocessing.dummy import Pool
 # Project-specific packages
 from queries_with_ref_bases import query_contains_ref_bases
+from run_report import start_stage, end_stage, count
+from result_sink import open_sink, write_result, close_sink, get_format, FORMATS
+from evidence import open_evidence, write_evidence, close_evidence
+from collapse_reads import get_multiplicity
+
+# Global variables are depicted in all uppercase
+HOMOZYGOUS_THRESHOLD = 0.8 # Fraction of reads containing the variant above which it is called homozygous
+HETEROZYGOUS_THRESHOLD = 0.3 # Fraction of reads containing the variant above which it is called heterozygous
+TRUNCATED_MARKER = '# PSST truncated' # Comment written into a .mbo file whose alignment early_stop.py stopped
+BATCH_MARKER = '# PSST batch ' # First line of a .mbo file holding several datasets, followed by their accessions
 
 def get_accession_map(fasta_path):
     '''
@@ -50,43 +60,121 @@ def get_mbo_paths(directory):
             paths[accession] = path
     return paths
 
+def parse_alignment(line,accession_map):
+    '''
+    Parses a line of Magic-BLAST tabular output
+    Inputs
+    - (str) line: the line
+    - (dict) accession_map: the map between integers and accessions
+    Outputs
+    - None if the line is a comment or malformed, otherwise an alignment dict. Its 'var_acc' is None if the read
+      was not aligned.
+    '''
+    tokens = line.split()
+    # Skip the line if it is commented or the number of fields isn't equal to 25
+    if len(tokens) != 25 or line[0] == "#":
+        return None
+    weight = get_multiplicity(tokens[0])
+    # The query read was not aligned
+    if tokens[1] == "-":
+        return {'var_acc': None, 'weight': weight}
+    var_acc = accession_map[ tokens[1] ]
+    ref_start = int(tokens[8])
+    ref_stop = int(tokens[9])
+    if ref_start > ref_stop:
+        temp = ref_start
+        ref_start = ref_stop
+        ref_stop = temp
+    btop = tokens[16]
+    return { 'var_acc': var_acc, 'ref_start': ref_start, 'ref_stop': ref_stop, 'btop': btop, 'weight': weight }
+
+def get_read_source(read_name):
+    '''
+    Returns the SRA accession a read comes from. Magic-BLAST names the reads of an SRA dataset
+    '<accession>.<spot>.<mate>', possibly behind a 'gnl|SRA|' prefix, and collapse_reads.py names collapsed reads
+    '<accession>.collapsed_<index>_x<multiplicity>' when given the accession as tag.
+    Inputs
+    - (str) read_name: the query name as it appears in the Magic-BLAST output
+    Outputs
+    - (str) the SRA accession
+    '''
+    return read_name[read_name.rfind('|') + 1:].split('.',1)[0]
+
 def get_sra_alignments(map_paths_and_partition):
     '''
     Given a list of paths as described in the function get_mbo_paths, retrieves the BTOP string for each
-    alignment.
+    alignment. Reads collapsed by collapse_reads.py get the number of identical reads they stand for as weight.
+    A .mbo file starting with BATCH_MARKER holds the alignments of several datasets, see batch_sra.py; it is
+    split into datasets by the accession in the read names in a single pass. Records whose read name does not
+    give one of its datasets are counted as 'records_unmatched' under the name of the batch and reported on STDERR.
     Inputs
     - map_paths_and_partition: a dict which contains the following:
         - partition: the list of paths to .mbo files to read
         - paths: a list of pairs where the first entry of the pair is the accession and the second is the path
         - (dict) accession_map: the map between integers and accessions
+        - (dict) counters: optional, filled with the per-accession parsing counters for the run report
     Outputs
     - a dictionary where keys are SRA accessions and the values are alignment dictionaries
     '''
     accession_map = map_paths_and_partition['map']
     paths = map_paths_and_partition['paths']
     partition = map_paths_and_partition['partition']
+    counters = map_paths_and_partition.get('counters',{})
     sra_alignments = {}
     for accession in partition:
         path = paths[accession]
-        alignments = []    
         with open(path,'r') as mbo:
-            for line in mbo:
-                tokens = line.split()
-                # Skip the line if it is commented, the number of fields isn't equal to 25 or
-                # the query read was not aligned
-                if line[0] != "#" and len(tokens) == 25 and tokens[1] != "-":
-                    var_acc = accession_map[ tokens[1] ]
-                    ref_start = int(tokens[8])
-                    ref_stop = int(tokens[9])
-                    if ref_start > ref_stop:
-                        temp = ref_start
-                        ref_start = ref_stop
-                        ref_stop = temp
-                    btop = tokens[16]
-                    alignment = { 'var_acc': var_acc, 'ref_start': ref_start,\
-                              'ref_stop': ref_stop, 'btop': btop }
-                    alignments.append( alignment )
-        sra_alignments[accession] = alignments
+            first_line = mbo.readline()
+            batched = first_line.startswith(BATCH_MARKER)
+            if batched:
+                sources = first_line[len(BATCH_MARKER):].strip().split(',')
+                lines = mbo
+            else:
+                sources = [accession]
+                lines = chain([first_line],mbo) if first_line else mbo
+            stages = {}
+            # The counters are kept in local integers and only added to the stages once the file is read, as
+            # this loop runs once per alignment
+            totals = {}
+            for source in sources:
+                sra_alignments[source] = []
+                stages[source] = start_stage('parse_alignments',source,resources=False)
+                totals[source] = [0,0,0] # Records parsed, reads parsed and reads aligned
+            truncated = 0
+            unmatched = 0
+            for line in lines:
+                if line.startswith(TRUNCATED_MARKER):
+                    truncated += 1
+                    continue
+                alignment = parse_alignment(line,accession_map)
+                if alignment is None:
+                    continue
+                if batched:
+                    source = get_read_source( line.split(None,1)[0] )
+                    if source not in stages:
+                        unmatched += 1
+                        continue
+                source_totals = totals[source]
+                source_totals[0] += 1
+                source_totals[1] += alignment['weight']
+                if alignment['var_acc'] is not None:
+                    sra_alignments[source].append( alignment )
+                    source_totals[2] += alignment['weight']
+        for source in sources:
+            stage = stages[source]
+            for counter, n in zip(['records_parsed','reads_parsed','reads_aligned','truncated'],\
+                                  totals[source] + [truncated]):
+                if n > 0:
+                    count(stage,counter,n)
+            counters[source] = end_stage(stage)['counters']
+        if batched:
+            # Demultiplexing relies on how Magic-BLAST names reads, so make any record it could not place visible
+            stage = start_stage('demultiplex_batch',accession,resources=False)
+            if unmatched > 0:
+                count(stage,'records_unmatched',unmatched)
+                sys.stderr.write( "Warning: %d records of %s do not belong to any dataset of the batch\n" % \
+                                  (unmatched,path) )
+            counters[accession] = end_stage(stage)['counters']
     return sra_alignments
 
 def get_var_info(path):
@@ -111,13 +199,15 @@ def get_var_info(path):
                 var_info[accession] = {'start':start,'stop':stop,'length':length}
     return var_info
 
-def call_variants(var_freq):
+def call_variants(var_freq,homozygous=HOMOZYGOUS_THRESHOLD,heterozygous=HETEROZYGOUS_THRESHOLD):
     '''
     Determines which variants exist in a given SRA dataset given the number of reads that do and do not contain
     the var
     Inputs
     - var_freq: a dict where the keys are SNP accessions and the values are dicts which contain the frequency of
             reads that do and reads that do not contain the SNP
+    - (float) homozygous: fraction of reads containing the variant above which it is called homozygous
+    - (float) heterozygous: fraction of reads containing the variant above which it is called heterozygous
     Outputs
     - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and 
                 heterozygous variants in separate lists 
@@ -125,18 +215,31 @@ def call_variants(var_freq):
     variants = {'heterozygous':[],'homozygous':[]}
     for var_acc in var_freq:
         frequencies = var_freq[var_acc]
-        true = frequencies['true']
-        false = frequencies['false']
-        try:
-            percentage = true/(true+false)
-            if percentage > 0.8: # For now, we use this simple heuristic.
-                variants['homozygous'].append(var_acc)
-            elif percentage > 0.3:
-                variants['heterozygous'].append(var_acc)
-        except ZeroDivisionError: # We ignore division errors because they correspond to no mapped reads
-            pass
+        genotype = call_genotype(frequencies['true'],frequencies['false'],homozygous,heterozygous)
+        if genotype is not None:
+            variants[genotype].append(var_acc)
     return variants
 
+def call_genotype(true,false,homozygous=HOMOZYGOUS_THRESHOLD,heterozygous=HETEROZYGOUS_THRESHOLD):
+    '''
+    Calls a single variant given the number of reads that do and do not contain it
+    Inputs
+    - (int) true: number of reads that contain the variant
+    - (int) false: number of reads that do not contain the variant
+    - (float) homozygous, heterozygous: the thresholds described in call_variants
+    Outputs
+    - 'homozygous', 'heterozygous' or None if the variant is not called
+    '''
+    try:
+        percentage = true/(true+false)
+        if percentage > homozygous: # For now, we use this simple heuristic.
+            return 'homozygous'
+        elif percentage > heterozygous:
+            return 'heterozygous'
+    except ZeroDivisionError: # We ignore division errors because they correspond to no mapped reads
+        pass
+    return None
+
 def call_sra_variants(alignments_and_info):
     '''
     For all SRA accession, determines which variants exist in the SRA dataset    
@@ -145,55 +248,65 @@ def call_sra_variants(alignments_and_info):
         - sra_alignments: dict where the keys are SRA accessions and the values are lists of alignment dicts
         - var_info: dict where the keys are variant accessions and the values are information concerning the variants
         - keys: list which contains the keys of the SRA accessions to analyze
+        - counters: optional dict, filled with the per-accession calling counters for the run report
     Outputs
     - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and 
                 heterozygous variants in separate lists 
     '''
     sra_alignments = alignments_and_info['alignments']
-    var_info = alignments_and_info['alignments']
+    var_info = alignments_and_info['info']
     keys = alignments_and_info['keys']
+    counters = alignments_and_info.get('counters',{})
     variants = {}
     for sra_acc in keys:
         alignments = sra_alignments[sra_acc]
         var_freq = {}
+        stage = start_stage('call_variants',sra_acc,resources=False)
         for alignment in alignments:
             var_acc = alignment['var_acc']
             # Get the flank information
             info = var_info[var_acc]
             if var_acc not in var_freq:
-                var_freq[var_acc] = {'true':0,'false':0}
+                var_freq[var_acc] = {'true':0,'false':0,'none':0}
+            # A collapsed read counts as many times as the number of identical reads it stands for
+            weight = alignment.get('weight',1)
             # Determine whether the variant exists in the particular SRA dataset
             var_called = query_contains_ref_bases(alignment,info)
             if var_called == True:
-                var_freq[var_acc]['true'] += 1    
+                var_freq[var_acc]['true'] += weight
             elif var_called == False:
-                var_freq[var_acc]['false'] += 1    
+                var_freq[var_acc]['false'] += weight
+            else:
+                var_freq[var_acc]['none'] += weight
+        # The read counters of the run report are the totals of var_freq, added once rather than per alignment
+        for call in ['true','false','none']:
+            reads = sum( [freq[call] for freq in var_freq.values()] )
+            if reads > 0:
+                count(stage,'reads_' + call,reads)
         sra_variants = call_variants(var_freq) 
+        # Keep the read counts so that result sinks can report the depth of each variant and so that they can
+        # be persisted in the evidence table
+        sra_variants['depth'] = var_freq
         variants[sra_acc] = sra_variants    
+        count(stage,'reads_spanning_variant',\
+              stage['counters'].get('reads_true',0) + stage['counters'].get('reads_false',0))
+        count(stage,'variants_called',len(sra_variants['heterozygous']) + len(sra_variants['homozygous']))
+        counters[sra_acc] = end_stage(stage)['counters']
     return variants
 
-def create_tsv(variants,output_path):
+def create_tsv(variants,output_path,sort=True):
     '''
     Creates a TSV file containing the set of variants each SRA dataset contains.
     Inputs
     - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and 
                 heterozygous variants in separate lists 
     - output_path: path to where to construct the output file
+    - (bool) sort: whether to order the SRA datasets and their variants by accession
     '''
-    with open(output_path,'w') as tsv:
-        header = "SRA\tHeterozygous SNPs\tHomozygous SNPs\n"
-        tsv.write(header)
-        for sra_acc in variants:
-            line = "%s" % (sra_acc)        
-            sra_variants = variants[sra_acc]
-            line = line + "\t"
-            for var_acc in sra_variants['heterozygous']:
-                line = line + var_acc + ","
-            line = line + "\t"
-            for var_acc in sra_variants['homozygous']:
-                line = line + var_acc + ","
-            tsv.write( line.rstrip() )
-            tsv.write('\n')
+    sink = open_sink(output_path,'tsv',sort)
+    for sra_acc in variants:
+        write_result(sink,sra_acc,variants[sra_acc])
+    close_sink(sink)
 
 def create_variant_matrix(variants):
     '''
@@ -238,6 +351,46 @@ def create_variant_matrix(variants):
             matrix[variant_2][variant_1] = matrix[variant_1][variant_2]
     return matrix
 
+def count_variants(variants):
+    '''
+    Counts, for each variant, the number of SRA datasets in which it was called heterozygous and homozygous
+    Inputs
+    - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and 
+                heterozygous variants in separate lists 
+    Outputs
+    - counts: a dict where the keys are variants and the values are dicts with the number of heterozygous and
+              homozygous calls
+    '''
+    counts = {}
+    for sra_acc in variants:
+        for genotype in ['heterozygous','homozygous']:
+            for var_acc in variants[sra_acc].get(genotype,[]):
+                if var_acc not in counts:
+                    counts[var_acc] = {'heterozygous':0,'homozygous':0}
+                counts[var_acc][genotype] += 1
+    return counts
+
+def write_variant_counts(counts,output_path):
+    '''
+    Writes the per-variant counts returned by count_variants into a TSV file sorted by variant
+    '''
+    with open(output_path,'w') as tsv:
+        tsv.write("SNP\tHeterozygous\tHomozygous\n")
+        for var_acc in sorted(counts):
+            tsv.write( "%s\t%d\t%d\n" % (var_acc,counts[var_acc]['heterozygous'],counts[var_acc]['homozygous']) )
+
+def write_variant_matrix(matrix,output_path):
+    '''
+    Writes the matrix returned by create_variant_matrix into a TSV file with one line per edge, i.e. per pair of
+    variants that occur together in at least one SRA dataset. Each pair is written once, sorted.
+    '''
+    with open(output_path,'w') as tsv:
+        tsv.write("SNP 1\tSNP 2\tDatasets\n")
+        for variant_1 in sorted(matrix):
+            for variant_2 in sorted(matrix[variant_1]):
+                if variant_1 < variant_2:
+                    tsv.write( "%s\t%s\t%d\n" % (variant_1,variant_2,matrix[variant_1][variant_2]) )
+
 def partition(lst,n):
     '''
     Partitions a list into n lists
@@ -247,21 +400,69 @@ def partition(lst,n):
     - partitioned_lists: a list of lists 
     '''
     division = len(lst)/float(n)
-    return [ lst[int(round(division * i)): int(round(division * (i + 1)))] for i in xrange(n) ]
+    return [ lst[int(round(division * i)): int(round(division * (i + 1)))] for i in range(n) ]
 
-def combine_list_of_dicts(list_of_dicts):
+def call_sra_dataset(task):
     '''
-    Given a list of dicts, returns a single dict such that (key,value) pairs from each original dict exists in the
-    new single dict
+    Reads the alignments of a single .mbo file and determines which variants each SRA dataset in it contains
     Inputs
-    - list_of_dicts: a list of dicts
+    - task: a dict which contains
+        - (str) accession: the SRA accession, or the name of a batch of datasets, of the .mbo file
+        - paths, map, info and counters as described in get_sra_alignments and call_sra_variants
     Outputs
-    - combined_dict 
+    - a list of pairs where the first entry is an SRA accession and the second is the dict of variants it contains
     '''
-    combined_dict = list_of_dicts[0]
-    for i in range(1,len(list_of_dicts)):
-        combined_dict.update( list_of_dicts[i] )
-    return combined_dict
+    accession = task['accession']
+    sra_alignments = get_sra_alignments({'map':task['map'],'paths':task['paths'],'partition':[accession],\
+                                         'counters':task['parse_counters']})
+    keys = sorted(sra_alignments)
+    variants = call_sra_variants({'alignments':sra_alignments,'keys':keys,'info':task['info'],\
+                                  'counters':task['call_counters']})
+    for sra_acc in keys:
+        # Record that the alignment of the dataset was stopped early by early_stop.py
+        if task['parse_counters'][sra_acc].get('truncated'):
+            variants[sra_acc]['truncated'] = True
+    return [(sra_acc,variants[sra_acc]) for sra_acc in keys]
+
+def call_all_variants(paths,accession_map,var_info,threads,stage=None,sink=None,evidence=None):
+    '''
+    Reads the alignments of every SRA dataset and determines which variants each of them contains, using up to
+    the given number of threads. Each dataset is handed to the sink as soon as it has been called.
+    Inputs
+    - paths: a dictionary where the keys are SRA accessions, or batch names, and the values are paths to .mbo files
+    - (dict) accession_map: the map between integers and accessions
+    - var_info: dict where the keys are variant accessions and the values are information concerning the variants
+    - (int) threads: the maximum number of threads
+    - stage: optional run report stage to which the totals of the per-accession counters are added
+    - sink: optional result sink, see result_sink.py
+    - evidence: optional evidence table in which the read counts of each dataset are persisted, see evidence.py
+    Outputs
+    - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and 
+                heterozygous variants in separate lists 
+    '''
+    parse_counters = {}
+    call_counters = {}
+    tasks = [{'accession':accession,'paths':paths,'map':accession_map,'info':var_info,\
+              'parse_counters':parse_counters,'call_counters':call_counters} for accession in sorted(paths)]
+    called_variants = {}
+    pool = Pool(processes=max(1,min(threads,len(tasks))))
+    # The results are consumed in this thread only, so the sink needs no locking
+    for results in pool.imap_unordered(call_sra_dataset,tasks):
+        for sra_acc, sra_variants in results:
+            called_variants[sra_acc] = sra_variants
+            if sink is not None:
+                write_result(sink,sra_acc,sra_variants)
+            if evidence is not None:
+                write_evidence(evidence,sra_acc,sra_variants['depth'],sra_variants.get('truncated',False))
+    pool.close()
+    pool.join()
+
+    # Totals over all accessions for the run report
+    if stage is not None:
+        for accession_counters in list(parse_counters.values()) + list(call_counters.values()):
+            for counter in accession_counters:
+                count(stage,counter,accession_counters[counter])
+    return called_variants
 
 def unit_tests():
     variants = {}
@@ -277,6 +478,33 @@ def unit_tests():
             assert( left_hand_side >= 1 )
             assert( right_hand_side >= 1 )
             assert( left_hand_side == right_hand_side )
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        # An empty .mbo file, e.g. left by a failed Magic-BLAST run, gives a dataset without alignments
+        path = os.path.join(directory,'SRR2.mbo')
+        open(path,'w').close()
+        assert( get_sra_alignments({'map':{},'paths':{'SRR2':path},'partition':['SRR2']}) == {'SRR2':[]} )
+        # A batch is split into its datasets by the accession in the read names
+        fields = ['0','100','21','0','0','1','21','1','21','+','+','21','21','0','0','21'] + ['0'] * 8
+        with open(path,'w') as mbo:
+            mbo.write( BATCH_MARKER + "SRR2,SRR3,SRR4\n" )
+            mbo.write( '\t'.join(['SRR3.1.1'] + fields) + '\n' )
+            mbo.write( '\t'.join(['SRR2.5.1'] + fields) + '\n' )
+            # A read name that does not give a dataset of the batch
+            mbo.write( '\t'.join(['read_7'] + fields) + '\n' )
+        counters = {}
+        sra_alignments = get_sra_alignments({'map':{'0':'rs1'},'paths':{'batch_0000':path},\
+                                             'partition':['batch_0000'],'counters':counters})
+        assert( sorted(sra_alignments) == ['SRR2','SRR3','SRR4'] )
+        assert( len(sra_alignments['SRR2']) == 1 and len(sra_alignments['SRR3']) == 1 )
+        assert( sra_alignments['SRR4'] == [] )
+        assert( counters['batch_0000'] == {'records_unmatched':1} )
+        assert( counters['SRR2']['records_parsed'] == 1 and 'records_unmatched' not in counters['SRR2'] )
+    finally:
+        shutil.rmtree(directory)
     print("All unit tests passed!")
 
 if __name__ == "__main__":
@@ -286,8 +514,13 @@ if __name__ == "__main__":
                      + "             using a heuristic."
     usage_message = "Usage: %s\n[-h (help and usage)]\n[-m <directory containing .mbo files>]\n" % (sys.argv[0]) \
                       + "[-v <path to variant info file>]\n[-f <path to the reference FASTA file>]\n"\
-                      + "[-o <output path for TSV file>]\n[-p <num of threads>]\n[-t <unit tests>]"
-    options = "htm:v:f:o:p:"
+                      + "[-o <output path for TSV file>]\n[-p <num of threads>]\n" \
+                      + "[-F <output format, one of %s; guessed from the output path by default>]\n" % (', '.join(FORMATS)) \
+                      + "[-S <sort the output by accession>]\n[-C <output path for per-variant counts>]\n" \
+                      + "[-M <output path for the variant co-occurrence matrix>]\n" \
+                      + "[-E <output path for the read evidence table, see evidence.py>]\n" \
+                      + "[-T <add the Truncated column to TSV output, for alignments stopped early>]\n[-t <unit tests>]"
+    options = "htSTm:v:f:o:p:F:C:M:E:"
 
     try:
         opts,args = getopt.getopt(sys.argv[1:],options)
@@ -305,6 +538,12 @@ if __name__ == "__main__":
     output_path = None
     fasta_path = None
     threads = 1
+    output_format = None
+    sort = False
+    counts_path = None
+    matrix_path = None
+    evidence_path = None
+    early_stop = False
     
     for opt, arg in opts:
         if opt == '-h':
@@ -320,7 +559,19 @@ if __name__ == "__main__":
         elif opt == '-f':
             fasta_path = arg
         elif opt == '-p':
-            threads = arg
+            threads = int(arg)
+        elif opt == '-F':
+            output_format = arg
+        elif opt == '-S':
+            sort = True
+        elif opt == '-T':
+            early_stop = True
+        elif opt == '-C':
+            counts_path = arg
+        elif opt == '-M':
+            matrix_path = arg
+        elif opt == '-E':
+            evidence_path = arg
         elif opt == '-t':
             unit_tests()
             sys.exit(0)
@@ -339,36 +590,31 @@ if __name__ == "__main__":
     if fasta_path == None:
         print("Error: please provide the path to the FASTA file used as reference for makeblastdb")
         opts_incomplete = True
+    if output_format != None and output_format not in FORMATS:
+        print("Error: the output format must be one of %s." % (', '.join(FORMATS)))
+        opts_incomplete = True
     if opts_incomplete:
         print(usage_message)
         sys.exit(1)
+    if output_format == None:
+        output_format = get_format(output_path)
 
+    stage = start_stage('call_variants')
     var_info = get_var_info(var_info_path)
     accession_map = get_accession_map(fasta_path)
     paths = get_mbo_paths(mbo_directory)
 
-    # Retrieve the alignments concurrently
-    get_alignments_threads = min(threads,len(paths.keys()))
-    paths_partitions = partition( paths.keys(), get_alignments_threads )
-    map_paths_and_partitions = [{'map':accession_map,'paths':paths,'partition':path_partition} \
-                                for path_partition in paths_partitions]
-    pool = Pool(processes=get_alignments_threads)
-    sra_alignments_pool = pool.map(get_sra_alignments,map_paths_and_partitions)
-    pool.close()
-    pool.join()
-    sra_alignments = combine_list_of_dicts(sra_alignments_pool) 
-
-    # Call variants concurrently
-    sra_keys = sra_alignments.keys()
-    variant_call_threads = min( threads, len(sra_keys) )
-    keys_partitions = partition(sra_keys, variant_call_threads)
-    # alignments, info and key partitions
-    alignments_and_info_part = [{'alignments':sra_alignments,'keys':keys,'info':var_info} for keys in keys_partitions]
-    pool = Pool(processes=variant_call_threads)
-    variants_pool = pool.map(call_sra_variants,alignments_and_info_part)
-    pool.close()
-    pool.join()
-    called_variants = combine_list_of_dicts(variants_pool)
-
-    create_tsv(called_variants,output_path)
+    sink = open_sink(output_path,output_format,sort,early_stop)
+    evidence = None
+    if evidence_path != None:
+        evidence = open_evidence(evidence_path)
+    called_variants = call_all_variants(paths,accession_map,var_info,threads,stage,sink,evidence)
+    close_sink(sink)
+    if evidence != None:
+        close_evidence(evidence)
     matrix = create_variant_matrix(called_variants)
+    if counts_path != None:
+        write_variant_counts(count_variants(called_variants),counts_path)
+    if matrix_path != None:
+        write_variant_matrix(matrix,matrix_path)
+    end_stage(stage)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import getopt
+import heapq
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+# Global variables are depicted in all uppercase
+NAME_PREFIX = 'collapsed_' # Prefix of the names of collapsed reads
+NAME_FORMAT = NAME_PREFIX + '%d_x%d' # Name of a collapsed read: its index and its multiplicity
+NAME_PATTERN = re.compile(r'^(?:[^.]+\.)?' + NAME_PREFIX + r'\d+_x(\d+)$') # Optionally tagged '<tag>.'
+MAX_SEQUENCES = 1000000 # Maximum number of distinct sequences held in memory before spilling to disk
+
+def get_multiplicity(read_name):
+    '''
+    Returns the number of identical reads a read stands for: the multiplicity encoded in its name by this script,
+    tagged or not, or 1 for reads that were not collapsed
+    Inputs
+    - (str) read_name: the query name as it appears in the Magic-BLAST output
+    Outputs
+    - (int) the multiplicity of the read
+    '''
+    if NAME_PREFIX in read_name:
+        match = NAME_PATTERN.match(read_name)
+        if match:
+            return int(match.group(1))
+    return 1
+
+def check_single_end(name,previous_name):
+    '''
+    Raises a ValueError if a read has the same name as the one before it, which is how fastq-dump --split-spot
+    writes the mates of a paired spot. Collapsing aligns every read on its own, whereas Magic-BLAST aligns the
+    mates of an SRA dataset as pairs, so the calls would differ.
+    '''
+    if name == previous_name:
+        raise ValueError("Paired reads found (%s appears twice in a row), but only single-end reads can be collapsed" \
+                         % (name))
+
+def read_sequences(in_stream,single_end=False):
+    '''
+    Yields the sequences of a FASTQ or FASTA stream, detected from its first character. Multi-line records are
+    joined in both formats. Since '@' may start a line of FASTQ qualities, the quality lines of a record are read
+    until they are as long as its sequence. A malformed FASTQ record raises a ValueError rather than being misread,
+    as do paired reads if single_end is set, see check_single_end.
+    '''
+    first = in_stream.readline()
+    name = None
+    if first.startswith('@'):
+        header = first
+        while header:
+            if not header.startswith('@'):
+                raise ValueError("Malformed FASTQ record: expected a header starting with '@', got %r" % (header))
+            if single_end:
+                previous_name, name = name, header[1:].split(None,1)[0]
+                check_single_end(name,previous_name)
+            sequence = []
+            line = in_stream.readline()
+            while line and not line.startswith('+'):
+                sequence.append( line.strip() )
+                line = in_stream.readline()
+            if not line:
+                raise ValueError("Malformed FASTQ record %s: missing '+' line" % (header.strip()))
+            sequence = ''.join(sequence)
+            quality_length = 0
+            while quality_length < len(sequence):
+                line = in_stream.readline()
+                if not line:
+                    raise ValueError("Malformed FASTQ record %s: truncated qualities" % (header.strip()))
+                quality_length += len( line.strip() )
+            if quality_length != len(sequence):
+                raise ValueError("Malformed FASTQ record %s: qualities and sequence differ in length" % \
+                                 (header.strip()))
+            yield sequence
+            header = in_stream.readline()
+            while header and len(header.strip()) == 0: # Trailing blank lines
+                header = in_stream.readline()
+    elif first.startswith('>'):
+        sequence = []
+        name = first[1:].split(None,1)[0] if len(first) > 1 else ''
+        for line in in_stream:
+            if line.startswith('>'):
+                yield ''.join(sequence)
+                sequence = []
+                if single_end:
+                    previous_name, name = name, line[1:].split(None,1)[0] if len(line.strip()) > 1 else ''
+                    check_single_end(name,previous_name)
+            else:
+                sequence.append( line.strip() )
+        yield ''.join(sequence)
+
+def spill(counts,directory):
+    '''
+    Writes the sequence counts held in memory into a file sorted by sequence
+    Outputs
+    - (str) the path to the spill file
+    '''
+    handle, path = tempfile.mkstemp(suffix='.counts',dir=directory)
+    with os.fdopen(handle,'w') as spill_stream:
+        for sequence in sorted(counts):
+            spill_stream.write( "%s\t%d\n" % (sequence,counts[sequence]) )
+    return path
+
+def read_spill(path):
+    '''
+    Yields the (sequence, count) pairs of a spill file in sorted order
+    '''
+    with open(path,'r') as spill_stream:
+        for line in spill_stream:
+            sequence, count = line.split('\t')
+            yield (sequence,int(count))
+
+def count_sequences(sequences,max_sequences=MAX_SEQUENCES,directory=None):
+    '''
+    Counts the occurrences of each distinct sequence with bounded memory. Whenever more than max_sequences
+    distinct sequences are held, they are spilled to a sorted file; the spill files are then merged and the
+    counts of equal sequences summed.
+    Inputs
+    - sequences: an iterable of sequences
+    - (int) max_sequences: the maximum number of distinct sequences held in memory
+    - (str) directory: directory for the spill files, the system default if None
+    Outputs
+    - yields (sequence, count) pairs in sorted order of sequence
+    '''
+    counts = {}
+    spill_dir = tempfile.mkdtemp(dir=directory)
+    spill_paths = []
+    try:
+        for sequence in sequences:
+            if len(sequence) == 0:
+                continue
+            if sequence in counts:
+                counts[sequence] += 1
+            else:
+                if len(counts) >= max_sequences:
+                    spill_paths.append( spill(counts,spill_dir) )
+                    counts = {}
+                counts[sequence] = 1
+        streams = [read_spill(path) for path in spill_paths]
+        streams.append( iter(sorted(counts.items())) )
+        counts = None
+        current_sequence = None
+        current_count = 0
+        for sequence, count in heapq.merge(*streams):
+            if sequence != current_sequence:
+                if current_sequence is not None:
+                    yield (current_sequence,current_count)
+                current_sequence = sequence
+                current_count = 0
+            current_count += count
+        if current_sequence is not None:
+            yield (current_sequence,current_count)
+    finally:
+        shutil.rmtree(spill_dir)
+
+def collapse_reads(in_stream,out_stream,max_sequences=MAX_SEQUENCES,directory=None,tag=None,single_end=False):
+    '''
+    Writes each distinct read sequence of a FASTQ or FASTA stream once as a FASTA record whose name carries the
+    number of reads it stands for, see NAME_FORMAT
+    Inputs
+    - in_stream: the FASTQ or FASTA input
+    - out_stream: the FASTA output
+    - (int) max_sequences: the maximum number of distinct sequences held in memory
+    - (str) directory: directory for the spill files
+    - (str) tag: optional prefix of the read names, e.g. the SRA accession when several datasets are aligned
+                 together, which gives names of the form '<tag>.collapsed_<index>_x<multiplicity>'
+    - (bool) single_end: whether to raise a ValueError on paired reads, see check_single_end
+    Outputs
+    - a pair with the number of reads read and the number of records written
+    '''
+    num_reads = 0
+    num_records = 0
+    name_format = NAME_FORMAT
+    if tag is not None:
+        name_format = tag + '.' + NAME_FORMAT
+    for sequence, count in count_sequences(read_sequences(in_stream,single_end),max_sequences,directory):
+        out_stream.write( ">%s\n%s\n" % (name_format % (num_records,count),sequence) )
+        num_reads += count
+        num_records += 1
+    return (num_reads,num_records)
+
+def unit_tests():
+    from io import StringIO
+    assert( get_multiplicity('collapsed_12_x340') == 340 )
+    assert( get_multiplicity('SRR001.1.1') == 1 )
+    assert( get_multiplicity('collapsed_reads') == 1 )
+    assert( get_multiplicity('SRR001.collapsed_3_x7') == 7 )
+
+    fastq = "@r1\nACGT\n+\nIIII\n@r2\nTTTT\n+\nIIII\n@r3\nACGT\n+\nIIII\n@r4\nGGGG\n+\nIIII\n@r5\nACGT\n+\nIIII\n"
+    expected = ">collapsed_0_x3\nACGT\n>collapsed_1_x1\nGGGG\n>collapsed_2_x1\nTTTT\n"
+    # Without and with spilling to disk
+    for max_sequences in [MAX_SEQUENCES,1]:
+        out_stream = StringIO()
+        assert( collapse_reads(StringIO(fastq),out_stream,max_sequences) == (5,3) )
+        assert( out_stream.getvalue() == expected )
+
+    # Wrapped FASTQ records, with a quality line starting with '@'
+    wrapped = "@r1\nAC\nGT\n+r1\n@I\nII\n@r2\nACGT\n+\nIIII\n\n"
+    assert( list(read_sequences(StringIO(wrapped))) == ['ACGT','ACGT'] )
+    for malformed in ["@r1\nACGT\nIIII\n","@r1\nACGT\n+\nII\n","@r1\nACGT\n+\nIIII\nr2\nACGT\n+\nIIII\n"]:
+        try:
+            list(read_sequences(StringIO(malformed)))
+            assert( False )
+        except ValueError:
+            pass
+
+    # fastq-dump --split-spot gives both mates of a paired spot the same name
+    paired = "@SRR001.1 a\nACGT\n+\nIIII\n@SRR001.1 a\nTTTT\n+\nIIII\n"
+    assert( list(read_sequences(StringIO(paired))) == ['ACGT','TTTT'] )
+    try:
+        list(read_sequences(StringIO(paired),single_end=True))
+        assert( False )
+    except ValueError:
+        pass
+    single = "@SRR001.1 a\nACGT\n+\nIIII\n@SRR001.2 b\nACGT\n+\nIIII\n"
+    assert( list(read_sequences(StringIO(single),single_end=True)) == ['ACGT','ACGT'] )
+
+    fasta = ">r1\nAC\nGT\n>r2\nACGT\n>r3\nTTTT\n"
+    assert( list(read_sequences(StringIO(fasta),single_end=True)) == ['ACGT','ACGT','TTTT'] )
+    out_stream = StringIO()
+    assert( collapse_reads(StringIO(fasta),out_stream) == (3,2) )
+    assert( out_stream.getvalue() == ">collapsed_0_x2\nACGT\n>collapsed_1_x1\nTTTT\n" )
+    out_stream = StringIO()
+    collapse_reads(StringIO(fasta),out_stream,tag='SRR001')
+    assert( out_stream.getvalue() == ">SRR001.collapsed_0_x2\nACGT\n>SRR001.collapsed_1_x1\nTTTT\n" )
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    help_message = "Description: collapses identical read sequences of a FASTQ or FASTA file into single FASTA records\n" \
+                 + "             whose names carry the number of reads they stand for. call_variants.py counts\n" \
+                 + "             each alignment of a collapsed read that many times."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-i <input FASTQ or FASTA, STDIN if not set>]\n" % (sys.argv[0]) \
+                  + "[-o <output FASTA, STDOUT if not set>]\n[-d <directory for spill files>]\n" \
+                  + "[-m <max number of distinct sequences in memory, default %d>]\n" % (MAX_SEQUENCES) \
+                  + "[-a <tag prefixed to the read names, e.g. the SRA accession>]\n" \
+                  + "[-s (fail on paired reads, i.e. consecutive reads with the same name)]\n[-t <unit tests>]"
+    options = "hti:o:d:m:a:s"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    input_path = None
+    output_path = None
+    directory = None
+    max_sequences = MAX_SEQUENCES
+    tag = None
+    single_end = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-i':
+            input_path = arg
+        elif opt == '-o':
+            output_path = arg
+        elif opt == '-d':
+            directory = arg
+        elif opt == '-m':
+            max_sequences = int(arg)
+        elif opt == '-a':
+            tag = arg
+        elif opt == '-s':
+            single_end = True
+        elif opt == '-t':
+            unit_tests()
+            sys.exit(0)
+
+    if input_path:
+        in_stream = open(input_path,'r')
+    else:
+        in_stream = sys.stdin
+    if output_path:
+        out_stream = open(output_path,'w')
+    else:
+        out_stream = sys.stdout
+    try:
+        num_reads, num_records = collapse_reads(in_stream,out_stream,max_sequences,directory,tag,single_end)
+    except ValueError as error:
+        sys.stderr.write( "Error: %s\n" % (error) )
+        sys.exit(1)
+    in_stream.close()
+    out_stream.close()
+    sys.stderr.write( "Collapsed %d reads into %d sequences\n" % (num_reads,num_records) )
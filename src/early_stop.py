@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import getopt
+import sys
+from call_variants import parse_alignment, call_genotype, get_var_info, get_accession_map, TRUNCATED_MARKER
+from queries_with_ref_bases import query_contains_ref_bases
+from run_report import start_stage, end_stage, count
+
+# Global variables are depicted in all uppercase
+STOP_DEPTH_VAR = 'PSST_STOP_DEPTH' # Environment variable that makes the Magic-BLAST scripts pipe through this script
+SNP_INFO_VAR = 'PSST_SNP_INFO' # Environment variable holding the path to the variant info file
+SNP_FASTA_VAR = 'PSST_SNP_FASTA' # Environment variable holding the path to the reference FASTA file
+STALL_RECORDS = 1000000 # Records after which unsettled variants without a new spanning read count as uncovered
+
+# Magic-BLAST writes its tabular output to STDOUT and this script sits at the other end of the pipe, copying the
+# alignments into the .mbo file while counting, for every variant, the reads that do and do not contain it. Once
+# the call of every variant is settled, it writes a TRUNCATED_MARKER comment, closes the .mbo file and exits.
+# Magic-BLAST then gets SIGPIPE on its next write and stops reading the dataset. A variant that no read spans, e.g. a
+# chrY SNP in a female sample or a deleted locus, never settles; so once STALL_RECORDS records have been copied
+# without any unsettled variant gaining a spanning read, the unsettled variants are taken as uncovered and the
+# alignment is stopped as well. A variant spanned by fewer than one in STALL_RECORDS reads may then be called on
+# fewer reads than in a full run.
+
+def is_settled(true,false,depth):
+    '''
+    Determines whether the call of a variant is settled, i.e. whether it is the call it would have after depth
+    spanning reads. This is the case once depth reads have been seen, or earlier if the call is the same whether
+    all of the remaining reads up to depth contain the variant or none of them do.
+    Inputs
+    - (int) true: number of reads that contain the variant
+    - (int) false: number of reads that do not contain the variant
+    - (int) depth: number of spanning reads after which a call is considered stable
+    Outputs
+    - (bool) True if the call is settled
+    '''
+    remaining = depth - (true + false)
+    if remaining <= 0:
+        return True
+    return call_genotype(true + remaining,false) == call_genotype(true,false + remaining)
+
+def stream_alignments(in_stream,out_stream,var_info,accession_map,depth,stage=None,stall_records=STALL_RECORDS):
+    '''
+    Copies Magic-BLAST tabular output from in_stream to out_stream until every variant in var_info is settled, or
+    until stall_records records have been copied without any unsettled variant gaining a spanning read
+    Inputs
+    - in_stream: the Magic-BLAST output
+    - out_stream: the .mbo file
+    - var_info: dict where the keys are variant accessions and the values are information concerning the variants
+    - (dict) accession_map: the map between integers and accessions
+    - (int) depth: see is_settled
+    - stage: optional run report stage in which the records copied and the variants left unsettled are counted
+    - (int) stall_records: see STALL_RECORDS
+    Outputs
+    - (bool) True if the output was truncated before the end of in_stream
+    '''
+    var_freq = dict( [(var_acc,{'true':0,'false':0}) for var_acc in var_info] )
+    unsettled = set( [var_acc for var_acc in var_info if not is_settled(0,0,depth)] )
+    records = 0
+    last_progress = 0 # Number of records copied when an unsettled variant last gained a spanning read
+    truncated = False
+    for line in in_stream:
+        out_stream.write(line)
+        alignment = parse_alignment(line,accession_map)
+        if alignment is None or alignment['var_acc'] is None:
+            continue
+        records += 1
+        var_acc = alignment['var_acc']
+        if var_acc in unsettled:
+            var_called = query_contains_ref_bases(alignment,var_info[var_acc])
+            if var_called == True:
+                var_freq[var_acc]['true'] += alignment['weight']
+            elif var_called == False:
+                var_freq[var_acc]['false'] += alignment['weight']
+            if var_called is not None:
+                last_progress = records
+                if is_settled(var_freq[var_acc]['true'],var_freq[var_acc]['false'],depth):
+                    unsettled.discard(var_acc)
+        if len(unsettled) == 0:
+            out_stream.write( "%s after every variant was settled at a depth of %d reads\n" % \
+                              (TRUNCATED_MARKER,depth) )
+            truncated = True
+            break
+        if records - last_progress >= stall_records:
+            out_stream.write( "%s after %d records without a new read spanning the %d unsettled variants\n" % \
+                              (TRUNCATED_MARKER,stall_records,len(unsettled)) )
+            truncated = True
+            break
+    if stage is not None:
+        count(stage,'records_copied',records)
+        if truncated:
+            count(stage,'variants_unsettled',len(unsettled))
+    return truncated
+
+def unit_tests():
+    from io import StringIO
+    assert( is_settled(3,2,5) )
+    assert( not is_settled(0,0,5) )
+    # 45 out of 45 reads contain the variant; even 5 more that do not would leave 90% > 80%
+    assert( is_settled(45,0,50) )
+    assert( not is_settled(40,0,50) )
+
+    accession_map = {'0':'rs1','1':'rs2'}
+    var_info = {'rs1':{'start':10,'stop':11,'length':21},'rs2':{'start':10,'stop':11,'length':21}}
+    def line(read,ref,btop,ref_stop='21'):
+        return '\t'.join( [read,ref,'100','21','0','0','1','21','1',ref_stop,'+','+','21',btop,'0','0',btop] \
+                          + ['0'] * 8 ) + '\n'
+    lines = [line('r1','0','21'),line('r2','0','21'),line('r3','1','10GA10'),line('r4','1','10GA10'),\
+             line('r5','0','21')]
+    out_stream = StringIO()
+    assert( stream_alignments(StringIO(''.join(lines)),out_stream,var_info,accession_map,2) )
+    output = out_stream.getvalue().splitlines(True)
+    assert( output[:4] == lines[:4] and output[4].startswith(TRUNCATED_MARKER) )
+    out_stream = StringIO()
+    assert( not stream_alignments(StringIO(''.join(lines)),out_stream,var_info,accession_map,3) )
+    assert( out_stream.getvalue() == ''.join(lines) )
+    # rs2 is never spanned, only its flank, so the alignment stops once 2 records have gone by without a new
+    # spanning read
+    lines = [line('r1','0','21'),line('r2','1','5','5'),line('r3','1','5','5'),line('r4','0','21')]
+    out_stream = StringIO()
+    stage = {'counters':{}}
+    assert( stream_alignments(StringIO(''.join(lines)),out_stream,var_info,accession_map,5,stage,2) )
+    output = out_stream.getvalue().splitlines(True)
+    assert( output[:3] == lines[:3] and output[3].startswith(TRUNCATED_MARKER) )
+    assert( stage['counters'] == {'records_copied':3,'variants_unsettled':2} )
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    help_message = "Description: Reads Magic-BLAST tabular output from STDIN and copies it into a .mbo file until\n" \
+                 + "             every variant has enough spanning reads for its call to be settled, then stops\n" \
+                 + "             so that Magic-BLAST stops aligning the dataset."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-v <path to variant info file>]\n" % (sys.argv[0]) \
+                  + "[-f <path to the reference FASTA file>]\n[-o <output .mbo file>]\n" \
+                  + "[-d <number of spanning reads per variant after which its call is settled>]\n" \
+                  + "[-s <records without a new spanning read after which unsettled variants count as\n" \
+                  + "     uncovered, default %d>]\n" % (STALL_RECORDS) \
+                  + "[-a <SRA accession, for the run report>]\n[-t <unit tests>]"
+    options = "htv:f:o:d:s:a:"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    if len(sys.argv) == 1:
+        print(help_message)
+        print(usage_message)
+        sys.exit()
+
+    var_info_path = None
+    fasta_path = None
+    output_path = None
+    depth = None
+    accession = None
+    stall_records = STALL_RECORDS
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-v':
+            var_info_path = arg
+        elif opt == '-f':
+            fasta_path = arg
+        elif opt == '-o':
+            output_path = arg
+        elif opt == '-d':
+            depth = int(arg)
+        elif opt == '-s':
+            stall_records = int(arg)
+        elif opt == '-a':
+            accession = arg
+        elif opt == '-t':
+            unit_tests()
+            sys.exit(0)
+
+    opts_incomplete = False
+
+    if var_info_path == None:
+        print("Error: please provide the path to the file containing flanking sequence information.")
+        opts_incomplete = True
+    if fasta_path == None:
+        print("Error: please provide the path to the FASTA file used as reference for makeblastdb")
+        opts_incomplete = True
+    if output_path == None:
+        print("Error: please provide an output path for the .mbo file.")
+        opts_incomplete = True
+    if depth == None:
+        print("Error: please provide the depth at which calls are settled.")
+        opts_incomplete = True
+    if opts_incomplete:
+        print(usage_message)
+        sys.exit(1)
+
+    stage = start_stage('early_stop',accession)
+    with open(output_path,'w') as out_stream:
+        truncated = stream_alignments(sys.stdin,out_stream,get_var_info(var_info_path),\
+                                      get_accession_map(fasta_path),depth,stage,stall_records)
+    count(stage,'truncated',int(truncated))
+    end_stage(stage)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+from __future__ import division
+import getopt
+import gzip
+import os
+import sys
+from result_sink import open_sink, write_result, close_sink, get_format, replace, FORMATS, PARTIAL_SUFFIX
+
+# Global variables are depicted in all uppercase
+EVIDENCE_NAME = 'evidence.tsv.gz' # Name of the evidence table in the working directory
+EVIDENCE_HEADER = "SRA\tSNP\tTrue\tFalse\tNone\n"
+NO_SNP = '-' # SNP column of the placeholder row of a dataset without aligned reads
+TRUNCATED_SNP = 'truncated' # SNP column of the row marking a dataset whose alignment early_stop.py stopped
+
+# The evidence table holds, for every SRA dataset and every SNP with at least one aligned read, the number of
+# reads that contain the variant (True), the number that do not (False) and the number that aligned to the SNP
+# flanks without spanning the variant (None), i.e. the counts query_contains_ref_bases returned while calling.
+# Since these are all the heuristic in call_variants needs, variants can be re-called under other thresholds
+# from this table alone, without parsing the .mbo files again. A dataset without any aligned read is recorded as
+# a single placeholder row whose SNP is NO_SNP, so that it is not dropped when variants are re-called. A dataset
+# whose alignment was stopped early has an extra row whose SNP is TRUNCATED_SNP.
+
+def open_evidence(path):
+    '''
+    Opens an evidence table for writing. Like result sinks, rows are appended to '<path>.partial', which is
+    atomically renamed to path by close_evidence.
+    Inputs
+    - (str) path: path of the gzipped evidence table
+    Outputs
+    - evidence: a dict to pass to write_evidence and close_evidence
+    '''
+    evidence = {'path':path,'partial_path':path + PARTIAL_SUFFIX}
+    evidence['stream'] = gzip.open(evidence['partial_path'],'wt')
+    evidence['stream'].write(EVIDENCE_HEADER)
+    return evidence
+
+def write_evidence(evidence,sra_acc,var_freq,truncated=False):
+    '''
+    Appends the read counts of one SRA dataset to an evidence table
+    Inputs
+    - evidence: the dict returned by open_evidence
+    - (str) sra_acc: the SRA accession
+    - var_freq: a dict where the keys are SNP accessions and the values are dicts with the number of 'true',
+                'false' and 'none' reads, as built by call_sra_variants in call_variants.py
+    - (bool) truncated: whether the alignment of the dataset was stopped early by early_stop.py
+    '''
+    lines = []
+    if truncated:
+        lines.append( "%s\t%s\t0\t0\t0\n" % (sra_acc,TRUNCATED_SNP) )
+    if len(var_freq) == 0:
+        lines.append( "%s\t%s\t0\t0\t0\n" % (sra_acc,NO_SNP) )
+    for var_acc in sorted(var_freq):
+        frequencies = var_freq[var_acc]
+        lines.append( "%s\t%s\t%d\t%d\t%d\n" % (sra_acc,var_acc,frequencies['true'],frequencies['false'],\
+                                                frequencies.get('none',0)) )
+    evidence['stream'].write( ''.join(lines) )
+
+def close_evidence(evidence):
+    '''
+    Finalizes an evidence table and atomically moves it to its path
+    '''
+    evidence['stream'].close()
+    replace(evidence['partial_path'],evidence['path'])
+
+def read_evidence(path):
+    '''
+    Reads an evidence table one SRA dataset at a time. The rows of a dataset are contiguous, so only one dataset
+    is held in memory at once.
+    Inputs
+    - (str) path: path of the gzipped evidence table
+    Outputs
+    - yields (sra_acc, var_freq, truncated) triples where var_freq and truncated are as described in
+      write_evidence
+    '''
+    current_acc = None
+    var_freq = {}
+    truncated = False
+    with gzip.open(path,'rt') as stream:
+        for line in stream:
+            tokens = line.split('\t')
+            if len(tokens) != 5 or tokens[0] == 'SRA':
+                continue # Skip the header, including those of concatenated tables
+            sra_acc = tokens[0]
+            if sra_acc != current_acc:
+                if current_acc is not None:
+                    yield (current_acc,var_freq,truncated)
+                current_acc = sra_acc
+                var_freq = {}
+                truncated = False
+            if tokens[1] == TRUNCATED_SNP:
+                truncated = True
+                continue
+            if tokens[1] == NO_SNP:
+                continue
+            var_freq[tokens[1]] = {'true':int(tokens[2]),'false':int(tokens[3]),'none':int(tokens[4])}
+    if current_acc is not None:
+        yield (current_acc,var_freq,truncated)
+
+def recall_variants(evidence_path,output_path,output_format='tsv',sort=False,homozygous=None,heterozygous=None,\
+                    early_stop=False):
+    '''
+    Calls the variants of every SRA dataset in an evidence table under the given thresholds
+    Inputs
+    - (str) evidence_path: path of the evidence table
+    - (str) output_path: path of the result file
+    - (str) output_format: one of the formats supported by result_sink.py
+    - (bool) sort: whether to order the results by accession
+    - (float) homozygous, heterozygous: the thresholds of call_variants in call_variants.py; the defaults of
+                                        call_variants are used when None
+    - (bool) early_stop: whether the alignments may have been stopped early, see open_sink in result_sink.py
+    Outputs
+    - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous
+                and heterozygous variants in separate lists
+    '''
+    from call_variants import call_variants, HOMOZYGOUS_THRESHOLD, HETEROZYGOUS_THRESHOLD
+    if homozygous is None:
+        homozygous = HOMOZYGOUS_THRESHOLD
+    if heterozygous is None:
+        heterozygous = HETEROZYGOUS_THRESHOLD
+    variants = {}
+    sink = open_sink(output_path,output_format,sort,early_stop)
+    for sra_acc, var_freq, truncated in read_evidence(evidence_path):
+        sra_variants = call_variants(var_freq,homozygous,heterozygous)
+        sra_variants['depth'] = var_freq
+        if truncated:
+            sra_variants['truncated'] = True
+        write_result(sink,sra_acc,sra_variants)
+        variants[sra_acc] = sra_variants
+    close_sink(sink)
+    return variants
+
+def unit_tests():
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory,EVIDENCE_NAME)
+        evidence = open_evidence(path)
+        write_evidence(evidence,'SRR2',{'b':{'true':5,'false':5,'none':1},'a':{'true':9,'false':1,'none':0}})
+        write_evidence(evidence,'SRR1',{'a':{'true':2,'false':8,'none':3}})
+        write_evidence(evidence,'SRR3',{})
+        write_evidence(evidence,'SRR4',{'a':{'true':1,'false':0,'none':0}},truncated=True)
+        close_evidence(evidence)
+        assert( not os.path.exists(path + PARTIAL_SUFFIX) )
+        assert( list(read_evidence(path)) == [('SRR2',{'a':{'true':9,'false':1,'none':0},\
+                                                       'b':{'true':5,'false':5,'none':1}},False),\
+                                              ('SRR1',{'a':{'true':2,'false':8,'none':3}},False),\
+                                              ('SRR3',{},False),\
+                                              ('SRR4',{'a':{'true':1,'false':0,'none':0}},True)] )
+        # Under the default thresholds
+        variants = recall_variants(path,os.path.join(directory,'results.tsv'),sort=True,early_stop=True)
+        assert( variants['SRR4']['truncated'] and 'truncated' not in variants['SRR2'] )
+        assert( variants['SRR2']['homozygous'] == ['a'] and variants['SRR2']['heterozygous'] == ['b'] )
+        assert( variants['SRR1']['homozygous'] == [] and variants['SRR1']['heterozygous'] == [] )
+        # The dataset without aligned reads is still part of the results
+        assert( variants['SRR3'] == {'heterozygous':[],'homozygous':[],'depth':{}} )
+        with open(os.path.join(directory,'results.tsv'),'r') as results:
+            lines = results.readlines()
+        assert( "SRR3\t\t\tno\n" in lines and "SRR4\t\ta\tyes\n" in lines )
+        # Under stricter and looser thresholds
+        variants = recall_variants(path,os.path.join(directory,'results.tsv'),homozygous=0.95,heterozygous=0.1)
+        assert( sorted(variants['SRR2']['heterozygous']) == ['a','b'] )
+        assert( variants['SRR1']['heterozygous'] == ['a'] )
+    finally:
+        shutil.rmtree(directory)
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    help_message = "Description: Given the read evidence table written by call_variants.py, calls the variants of\n" \
+                 + "             every SRA dataset again under the given thresholds without re-parsing the\n" \
+                 + "             Magic-BLAST output files."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-i <path to the evidence table>]\n" % (sys.argv[0]) \
+                  + "[-o <output path for the results>]\n" \
+                  + "[-F <output format, one of %s; guessed from the output path by default>]\n" % (', '.join(FORMATS)) \
+                  + "[-S <sort the output by accession>]\n" \
+                  + "[-H <fraction of reads above which a variant is homozygous, default 0.8>]\n" \
+                  + "[-e <fraction of reads above which a variant is heterozygous, default 0.3>]\n" \
+                  + "[-C <output path for per-variant counts>]\n" \
+                  + "[-M <output path for the variant co-occurrence matrix>]\n" \
+                  + "[-T <add the Truncated column to TSV output, for tables of alignments stopped early>]\n" \
+                  + "[-t <unit tests>]"
+    options = "htSTi:o:F:H:e:C:M:"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    if len(sys.argv) == 1:
+        print(help_message)
+        print(usage_message)
+        sys.exit()
+
+    evidence_path = None
+    output_path = None
+    output_format = None
+    sort = False
+    homozygous = None
+    heterozygous = None
+    counts_path = None
+    matrix_path = None
+    early_stop = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-i':
+            evidence_path = arg
+        elif opt == '-o':
+            output_path = arg
+        elif opt == '-F':
+            output_format = arg
+        elif opt == '-S':
+            sort = True
+        elif opt == '-T':
+            early_stop = True
+        elif opt == '-H':
+            homozygous = float(arg)
+        elif opt == '-e':
+            heterozygous = float(arg)
+        elif opt == '-C':
+            counts_path = arg
+        elif opt == '-M':
+            matrix_path = arg
+        elif opt == '-t':
+            unit_tests()
+            sys.exit(0)
+
+    opts_incomplete = False
+
+    if evidence_path == None:
+        print("Error: please provide the path to the evidence table.")
+        opts_incomplete = True
+    if output_path == None:
+        print("Error: please provide an output path for the results.")
+        opts_incomplete = True
+    if output_format != None and output_format not in FORMATS:
+        print("Error: the output format must be one of %s." % (', '.join(FORMATS)))
+        opts_incomplete = True
+    if opts_incomplete:
+        print(usage_message)
+        sys.exit(1)
+    if output_format == None:
+        output_format = get_format(output_path)
+
+    variants = recall_variants(evidence_path,output_path,output_format,sort,homozygous,heterozygous,early_stop)
+    if counts_path != None or matrix_path != None:
+        from call_variants import count_variants, create_variant_matrix, write_variant_counts, write_variant_matrix
+        if counts_path != None:
+            write_variant_counts(count_variants(variants),counts_path)
+        if matrix_path != None:
+            write_variant_matrix(create_variant_matrix(variants),matrix_path)
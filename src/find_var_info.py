@@ -2,6 +2,7 @@
 import sys
 import argparse
 from get_alleles import get_nth_allele
+from run_report import start_stage, end_stage, count
 
 def find_var_info(sequences):
 	'''
@@ -74,6 +75,7 @@ if __name__ == '__main__':
 		unit_test()
 		sys.exit(0)
 	
+	stage = start_stage('find_var_info')
 	if args.input:
 		input_stream = open(args.input,'r')
 	else:
@@ -106,3 +108,5 @@ if __name__ == '__main__':
 	else:
 		for line in info_lines:
 			print(line) 
+	count(stage,'snps',len(info_lines))
+	end_stage(stage)
@@ -1,25 +1,32 @@
 #!/usr/bin/env python
-from Bio import Entrez
 import sys
 import getopt
+from run_report import start_stage, end_stage, count
 
 def get_var_flanking_sequences(accessions,email):
     flanking_sequences = {}
-    Entrez.email = email
+    var_ids = []
     for var_id in accessions:
         var_id = var_id.rstrip()
         if var_id.startswith('rs'):
             var_id = var_id[len('rs'):] 
         var_id = var_id.rstrip()
         if len(var_id) > 0:
-            handle = Entrez.esummary(db='snp',id=var_id,retmode='xml') 
-            records = Entrez.parse(handle)
-            for record in records:
-                docsum = record['DOCSUM']
-                docsum_tokens = docsum.split('|')
-                flanking_seq = [token for token in docsum_tokens if 'SEQ=' in token][0].split('=')[1]
-                flanking_sequences[var_id] = flanking_seq
-            handle.close()
+            var_ids.append(var_id)
+    if len(var_ids) == 0:
+        return flanking_sequences
+    # Biopython is only imported once there is something to fetch
+    from Bio import Entrez
+    Entrez.email = email
+    for var_id in var_ids:
+        handle = Entrez.esummary(db='snp',id=var_id,retmode='xml') 
+        records = Entrez.parse(handle)
+        for record in records:
+            docsum = record['DOCSUM']
+            docsum_tokens = docsum.split('|')
+            flanking_seq = [token for token in docsum_tokens if 'SEQ=' in token][0].split('=')[1]
+            flanking_sequences[var_id] = flanking_seq
+        handle.close()
     return flanking_sequences
 
 def write_flanking_sequences(flanking_sequences,output_path):
@@ -79,6 +86,7 @@ def main(argv):
     if opts_incomplete:
         sys.exit(1)
 
+    stage = start_stage('get_var_flanks')
     accessions = []
 
     with open(accessions_file,'r') as in_stream:
@@ -86,6 +94,9 @@ def main(argv):
             accessions.append( line.rstrip() )     
     flanking_sequences = get_var_flanking_sequences(accessions,email)
     write_flanking_sequences(flanking_sequences,output_path)
+    count(stage,'snps_requested',len(accessions))
+    count(stage,'snps_fetched',len(flanking_sequences))
+    end_stage(stage)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -2,11 +2,13 @@
 # Copyright: NCBI 2017
 # Author: Sean La
 
-if [ "$#" -ne 4 ]; then
+if [ "$#" -ne 4 ] && [ "$#" -ne 5 ]; then
 	echo "Description: Given a FASTQ file and a BLAST database, this script runs Magic-BLAST" 
-	echo "             on each SRA dataset."
+	echo "             on each SRA dataset. If collapsing is set to 1, identical reads are collapsed into a single"
+	echo "             read before alignment."
 	BASENAME=`basename "$0"`
 	echo "Usage: ${BASENAME} [FASTQ file] [BLAST DB name] [output dir] [threads]"
+	echo "       [collapse duplicate reads, 0 or 1 (optional)]"
 	exit 0
 fi
 
@@ -15,9 +17,44 @@ FASTQ=$1
 DB_NAME=$2
 OUTPUT_DIR=$3
 THREADS=$4
+COLLAPSE=${5:-0}
+
+if [ "${COLLAPSE}" == "1" ] && [ -n "${PSST_STOP_DEPTH}" ]; then
+	echo "Error: collapsing duplicate reads cannot be combined with PSST_STOP_DEPTH." >&2
+	exit 1
+fi
 
 # This prevents ambiguous splicing from occuring in Magic-BLAST
 export MAPPER_NO_OVERLAPPED_HSP_MERGED=1
 BASENAME=`basename "${FASTQ}"`
 OUTPUT_FILE=${OUTPUT_DIR}/${BASENAME/.*/.mbo}
-magicblast -query ${FASTQ} -infmt fastq -db ${DB_NAME} -out ${OUTPUT_FILE} -outfmt tabular -parse_deflines T -num_threads ${THREADS}
+# When run from psst.sh, record the Magic-BLAST run in the run report
+SRC=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
+REPORT=""
+COLLAPSE_REPORT=""
+if [ -n "${PSST_REPORT_DIR}" ]; then
+	REPORT="${SRC}/run_report.py -r ${PSST_REPORT_DIR} -n magicblast -a ${BASENAME%%.*} --"
+	COLLAPSE_REPORT="${SRC}/run_report.py -r ${PSST_REPORT_DIR} -n collapse_reads -a ${BASENAME%%.*} --"
+fi
+if [ "${COLLAPSE}" == "1" ]; then
+	# Align each distinct sequence once; call_variants.py counts it as many times as the reads it stands for
+	QUERY=${OUTPUT_DIR}/${BASENAME%%.*}.collapsed.fasta
+	INFMT=fasta
+	if ! ${COLLAPSE_REPORT} ${SRC}/collapse_reads.py -i ${FASTQ} -d ${OUTPUT_DIR} -o ${QUERY}; then
+		echo "Error: the reads of ${FASTQ} could not be collapsed." >&2
+		rm -f ${QUERY}
+		exit 1
+	fi
+else
+	QUERY=${FASTQ}
+	INFMT=fastq
+fi
+if [ -n "${PSST_STOP_DEPTH}" ]; then
+	# Stop aligning once the call of every SNP is settled at PSST_STOP_DEPTH spanning reads, see early_stop.py
+	${REPORT} bash -c "magicblast -query ${QUERY} -infmt ${INFMT} -db ${DB_NAME} -outfmt tabular -parse_deflines T -num_threads ${THREADS} | ${SRC}/early_stop.py -v ${PSST_SNP_INFO} -f ${PSST_SNP_FASTA} -d ${PSST_STOP_DEPTH} -a ${BASENAME%%.*} -o ${OUTPUT_FILE}"
+else
+	${REPORT} magicblast -query ${QUERY} -infmt ${INFMT} -db ${DB_NAME} -out ${OUTPUT_FILE} -outfmt tabular -parse_deflines T -num_threads ${THREADS}
+fi
+if [ "${COLLAPSE}" == "1" ]; then
+	rm -f ${QUERY}
+fi
@@ -2,11 +2,18 @@
 # Copyright: NCBI 2017
 # Author: Sean La
 
-if [ "$#" -ne 5 ]; then
+if [ "$#" -ne 5 ] && [ "$#" -ne 6 ]; then
 	echo "Description: Given a file containing SRA accessions and a BLAST database, this script runs Magic-BLAST" 
-	echo "             on each SRA dataset."
+	echo "             on each SRA dataset. If collapsing is set to 1, identical reads are collapsed into a single"
+	echo "             read before alignment; this only applies to single-end datasets, paired ones are skipped."
 	BASENAME=`basename "$0"`
 	echo "Usage: ${BASENAME} [SRA accessions file] [BLAST DB name] [output dir] [threads] [max child procs]"
+	echo "       [collapse duplicate reads, 0 or 1 (optional)]"
+	echo "       If PSST_STOP_DEPTH is set, the alignments are piped through early_stop.py, which stops the"
+	echo "       alignment of a dataset once every SNP has that many spanning reads (see psst.sh -D)."
+	echo "       If PSST_BATCH_BYTES is set, datasets smaller than half of it are packed into batches of at most"
+	echo "       that many bytes, each aligned by a single Magic-BLAST run (see batch_sra.py and psst.sh -b)."
+	echo "       The alignment of a batch is never stopped early."
 	exit 0
 fi
 
@@ -16,16 +23,135 @@ DB_NAME=$2
 OUTPUT_DIR=$3
 THREADS=$4
 MAX_PROCS=$5
+COLLAPSE=${6:-0}
+
+if [ "${COLLAPSE}" == "1" ] && [ -n "${PSST_STOP_DEPTH}" ]; then
+	echo "Error: collapsing duplicate reads cannot be combined with PSST_STOP_DEPTH." >&2
+	exit 1
+fi
 
 # This prevents ambiguous splicing from occuring in Magic-BLAST
 export MAPPER_NO_OVERLAPPED_HSP_MERGED=1
 
-for ACC in $(cat ${SRA}); do
-	OUTPUT_FILE=${OUTPUT_DIR}/${ACC}.mbo
-	magicblast -sra ${ACC} -db ${DB_NAME} -out ${OUTPUT_FILE} -outfmt tabular -parse_deflines T -num_threads ${THREADS} &
+# When run from psst.sh, record each Magic-BLAST run in the run report
+SRC=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
+report_prefix() {
+	if [ -n "${PSST_REPORT_DIR}" ]; then
+		echo "${SRC}/run_report.py -r ${PSST_REPORT_DIR} -n $1 -a $2 --"
+	fi
+}
+
+# Runs Magic-BLAST with the given query arguments. When PSST_STOP_DEPTH is set, the alignments are piped through
+# early_stop.py, which writes them to the .mbo file and exits once the call of every SNP is settled; Magic-BLAST
+# then stops on its next write.
+run_magicblast() {
+	ACC=$1
+	OUTPUT_FILE=$2
+	shift 2
+	if [ -n "${PSST_STOP_DEPTH}" ]; then
+		${REPORT} bash -c "magicblast $* -db ${DB_NAME} -outfmt tabular -parse_deflines T -num_threads ${THREADS} | ${SRC}/early_stop.py -v ${PSST_SNP_INFO} -f ${PSST_SNP_FASTA} -d ${PSST_STOP_DEPTH} -a ${ACC} -o ${OUTPUT_FILE}"
+	else
+		${REPORT} magicblast "$@" -db ${DB_NAME} -out ${OUTPUT_FILE} -outfmt tabular -parse_deflines T -num_threads ${THREADS}
+	fi
+}
+
+# Streams the reads of an SRA dataset through collapse_reads.py, which writes each distinct sequence once, into
+# a FASTA file, with the given collapse_reads.py options. Collapsing aligns every read on its own whereas
+# 'magicblast -sra' aligns mates as pairs, so collapse_reads.py -s fails on paired datasets. If either fastq-dump or
+# collapse_reads.py fails, the FASTA file is removed and the function fails, so that a dataset that could not be
+# read is not called as empty.
+collapse_sra() {
+	local ACC=$1
+	local FASTA=$2
+	local OPTIONS=$3
+	if ! $(report_prefix collapse_reads ${ACC}) bash -c "set -o pipefail; fastq-dump --split-spot --skip-technical -Z ${ACC} | ${SRC}/collapse_reads.py -s -d ${OUTPUT_DIR} ${OPTIONS} -o ${FASTA}"; then
+		echo "Error: the reads of ${ACC} could not be collapsed, skipping its alignment." >&2
+		rm -f ${FASTA}
+		return 1
+	fi
+}
+
+# Aligns the collapsed reads of an SRA dataset. call_variants.py counts each of them as many times as the reads
+# it stands for.
+align_collapsed() {
+	ACC=$1
+	OUTPUT_FILE=$2
+	FASTA=${OUTPUT_DIR}/${ACC}.collapsed.fasta
+	if collapse_sra ${ACC} ${FASTA}; then
+		run_magicblast ${ACC} ${OUTPUT_FILE} -query ${FASTA} -infmt fasta
+	fi
+	rm -f ${FASTA}
+}
+
+# Aligns several SRA datasets, given as a comma-separated list, with a single Magic-BLAST run. The output starts
+# with a '# PSST batch' line listing the datasets, and call_variants.py splits it back into datasets by the
+# accession Magic-BLAST puts in each read name. Collapsed reads are tagged with their accession for the same purpose.
+# The output is written to a partial file that is only moved into place if Magic-BLAST succeeds, so that a failed
+# batch is not called as a batch of datasets without alignments.
+align_batch() {
+	NAME=$1
+	ACCS=$2
+	OUTPUT_FILE=$3
+	if [ "${COLLAPSE}" == "1" ]; then
+		FASTA=${OUTPUT_DIR}/${NAME}.collapsed.fasta
+		rm -f ${FASTA}
+		# Datasets whose reads could not be collapsed are left out of the batch, and thus out of the results
+		COLLAPSED=""
+		for ACC in ${ACCS//,/ }; do
+			if collapse_sra ${ACC} ${FASTA}.${ACC} "-a ${ACC}"; then
+				cat ${FASTA}.${ACC} >> ${FASTA}
+				COLLAPSED=${COLLAPSED:+${COLLAPSED},}${ACC}
+			fi
+			rm -f ${FASTA}.${ACC}
+		done
+		if [ -z "${COLLAPSED}" ]; then
+			rm -f ${FASTA}
+			return 1
+		fi
+		ACCS=${COLLAPSED}
+		QUERY="-query ${FASTA} -infmt fasta"
+	else
+		QUERY="-sra ${ACCS}"
+	fi
+	echo "# PSST batch ${ACCS}" > ${OUTPUT_FILE}.partial
+	if ${REPORT} bash -c "magicblast ${QUERY} -db ${DB_NAME} -outfmt tabular -parse_deflines T -num_threads ${THREADS} >> ${OUTPUT_FILE}.partial"; then
+		mv ${OUTPUT_FILE}.partial ${OUTPUT_FILE}
+		STATUS=0
+	else
+		echo "Error: the alignment of batch ${NAME} (${ACCS}) failed, skipping its datasets." >&2
+		rm -f ${OUTPUT_FILE}.partial
+		STATUS=1
+	fi
+	if [ "${COLLAPSE}" == "1" ]; then
+		rm -f ${FASTA}
+	fi
+	return ${STATUS}
+}
+
+# Each line holds the name of a .mbo file and the comma-separated accessions aligned into it. Without batching,
+# every dataset is aligned on its own into a .mbo file named after it.
+if [ -n "${PSST_BATCH_BYTES}" ]; then
+	BATCHES=$( ${SRC}/batch_sra.py -i ${SRA} -o /dev/stdout -b ${PSST_BATCH_BYTES} -p ${MAX_PROCS} )
+else
+	BATCHES=$( awk 'NF { print $1 "\t" $1 }' ${SRA} )
+fi
+
+while read NAME ACCS <&3; do
+	if [ -z "${NAME}" ]; then
+		continue
+	fi
+	OUTPUT_FILE=${OUTPUT_DIR}/${NAME}.mbo
+	REPORT=$(report_prefix magicblast ${NAME})
+	if [ "${NAME}" != "${ACCS}" ]; then
+		align_batch ${NAME} ${ACCS} ${OUTPUT_FILE} &
+	elif [ "${COLLAPSE}" == "1" ]; then
+		align_collapsed ${NAME} ${OUTPUT_FILE} &
+	else
+		run_magicblast ${NAME} ${OUTPUT_FILE} -sra ${NAME} &
+	fi
 	# Limit the number of child processes running so we don't overload the local computer
 	while [ $(jobs -r | wc -l) -ge "${MAX_PROCS}" ]; do sleep 1; done
-done
+done 3<<< "${BATCHES}"
 
 # Wait for all processes to finish before exiting
 wait
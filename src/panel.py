@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Global variables are depicted in all uppercase
+PANEL_VERSION = 1 # Version of the bundle layout; bundles of another version are rebuilt
+MANIFEST_NAME = 'panel.json' # Name of the manifest describing a bundle
+ACCESSION_MAP_NAME = 'accession_map.tsv' # Name of the map from Magic-BLAST reference labels to SNP accessions
+FLANK_SOURCE = 'entrez:snp:docsum' # Flanking sequences fetched from dbSNP by get_var_flanks.py
+PARTIAL_SUFFIX = '.partial'
+
+# A SNP panel bundle holds everything psst.sh builds before alignment: the flanking sequences (snp_flanks.txt),
+# the variant information (snp_info.txt), the reference FASTA file (snp_flanks.fasta), the accession map and the
+# BLAST database. A bundle is named after a hash of the sorted SNP accessions and of the source of the flanking
+# sequences, so building the same panel again finds the existing bundle instead of fetching and indexing anew.
+
+def normalize_accessions(accessions):
+    '''
+    Returns the sorted, distinct SNP accessions without their 'rs' prefix, as get_var_flanks.py fetches them
+    '''
+    normalized = set()
+    for accession in accessions:
+        accession = accession.strip()
+        if accession.startswith('rs'):
+            accession = accession[len('rs'):]
+        if len(accession) > 0:
+            normalized.add(accession)
+    return sorted(normalized)
+
+def get_panel_key(accessions,flank_source=FLANK_SOURCE):
+    '''
+    Returns the key of the bundle of a SNP panel
+    Inputs
+    - accessions: the SNP accessions, in any order and with or without their 'rs' prefix
+    - (str) flank_source: where the flanking sequences come from
+    Outputs
+    - (str) a hexadecimal SHA-256 prefix of the sorted accessions and the flank source
+    '''
+    digest = hashlib.sha256()
+    for accession in normalize_accessions(accessions):
+        digest.update( (accession + '\n').encode('utf-8') )
+    digest.update( ('source=%s\n' % (flank_source)).encode('utf-8') )
+    return digest.hexdigest()[:16]
+
+def get_file_source(flanks_path):
+    '''
+    Returns the flank source of flanking sequences read from a file rather than fetched, which depends on the
+    content of the file so that editing it gives another bundle
+    '''
+    digest = hashlib.sha256()
+    with open(flanks_path,'rb') as in_stream:
+        for block in iter(lambda: in_stream.read(1 << 20),b''):
+            digest.update(block)
+    return 'file:sha256:%s' % (digest.hexdigest())
+
+def read_manifest(bundle_dir):
+    '''
+    Reads the manifest of a bundle
+    Outputs
+    - manifest: a dict, or None if bundle_dir is not a bundle of the current version
+    '''
+    path = os.path.join(bundle_dir,MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path,'r') as in_stream:
+        manifest = json.load(in_stream)
+    if manifest.get('version') != PANEL_VERSION:
+        return None
+    return manifest
+
+def is_bundle(path):
+    '''
+    Returns True if path is the directory of a bundle of the current version
+    '''
+    return os.path.isdir(path) and read_manifest(path) is not None
+
+def build_panel(panels_dir,accessions=None,email=None,flanks_path=None):
+    '''
+    Builds the bundle of a SNP panel, or returns the existing one. The bundle is built in a directory of its own,
+    '<key>.<random>.partial', and renamed to '<key>' once complete, so neither an interrupted build nor concurrent
+    builds of the same panel, e.g. by several cluster jobs, can leave or destroy a half-built bundle. A build that
+    fails, e.g. because Entrez or makeblastdb does, removes its directory before raising the error.
+    Inputs
+    - (str) panels_dir: directory holding the bundles
+    - accessions: the SNP accessions, whose flanking sequences are fetched from Entrez
+    - (str) email: email address to give to Entrez
+    - (str) flanks_path: alternatively, a file of flanking sequences as written by get_var_flanks.py
+    Outputs
+    - (str) the path to the bundle directory
+    '''
+    from psst import find_flanks, find_info, build_reference
+    from var_flanks_to_fasta import read_flanking_sequences
+    if flanks_path is not None:
+        flanking_sequences = dict( read_flanking_sequences(flanks_path) )
+        accessions = list(flanking_sequences)
+        flank_source = get_file_source(flanks_path)
+    else:
+        flank_source = FLANK_SOURCE
+    accessions = normalize_accessions(accessions)
+    key = get_panel_key(accessions,flank_source)
+    panels_dir = os.path.abspath(panels_dir)
+    bundle_dir = os.path.join(panels_dir,key)
+    if is_bundle(bundle_dir):
+        return bundle_dir
+    if not os.path.isdir(panels_dir):
+        try:
+            os.makedirs(panels_dir)
+        except OSError: # Another build may have created it concurrently
+            pass
+    partial_dir = tempfile.mkdtemp(prefix=key + '.',suffix=PARTIAL_SUFFIX,dir=panels_dir)
+    try:
+        if flanks_path is None:
+            flanking_sequences = find_flanks(accessions,email,partial_dir,True)
+        else:
+            from get_var_flanks import write_flanking_sequences
+            write_flanking_sequences(flanking_sequences,os.path.join(partial_dir,'snp_flanks.txt'))
+        find_info(flanking_sequences,partial_dir,True)
+        accession_map = build_reference(flanking_sequences,partial_dir)
+        with open(os.path.join(partial_dir,ACCESSION_MAP_NAME),'w') as out_stream:
+            for label in sorted(accession_map,key=int):
+                out_stream.write( "%s\t%s\n" % (label,accession_map[label]) )
+        manifest = {'version':PANEL_VERSION,'key':key,'flank_source':flank_source,'snp_accessions':accessions,\
+                    'snps_found':len(accession_map),'created':time.strftime('%Y-%m-%dT%H:%M:%S'),\
+                    'files':sorted(os.listdir(partial_dir)) + [MANIFEST_NAME]}
+        with open(os.path.join(partial_dir,MANIFEST_NAME),'w') as out_stream:
+            json.dump(manifest,out_stream,indent=2,sort_keys=True)
+    except:
+        shutil.rmtree(partial_dir,ignore_errors=True)
+        raise
+    if os.path.isdir(bundle_dir) and not is_bundle(bundle_dir):
+        shutil.rmtree(bundle_dir,ignore_errors=True) # A bundle of another version
+    try:
+        os.rename(partial_dir,bundle_dir)
+    except OSError:
+        # Another build of the same panel renamed its directory first
+        if not is_bundle(bundle_dir):
+            raise
+        shutil.rmtree(partial_dir)
+    return bundle_dir
+
+def load_panel(bundle_dir):
+    '''
+    Loads what calling variants needs from a bundle
+    Inputs
+    - (str) bundle_dir: the bundle directory
+    Outputs
+    - panel: a dict with the manifest, the variant information and the accession map, as well as the paths to the
+             variant information and reference FASTA files
+    '''
+    from call_variants import get_var_info
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        raise ValueError("%s is not a SNP panel bundle of version %d" % (bundle_dir,PANEL_VERSION))
+    panel = {'manifest':manifest,'dir':os.path.abspath(bundle_dir),\
+             'snp_info':os.path.join(bundle_dir,'snp_info.txt'),'fasta':os.path.join(bundle_dir,'snp_flanks.fasta')}
+    panel['var_info'] = get_var_info(panel['snp_info'])
+    panel['accession_map'] = {}
+    with open(os.path.join(bundle_dir,ACCESSION_MAP_NAME),'r') as in_stream:
+        for line in in_stream:
+            tokens = line.split()
+            if len(tokens) == 2:
+                panel['accession_map'][tokens[0]] = tokens[1]
+    return panel
+
+def unit_tests():
+    assert( get_panel_key(['rs2','rs1','1']) == get_panel_key(['1','2']) )
+    assert( get_panel_key(['1','2']) != get_panel_key(['1','2','3']) )
+    assert( get_panel_key(['1','2']) != get_panel_key(['1','2'],'file:sha256:0') )
+    directory = tempfile.mkdtemp()
+    try:
+        flanks_path = os.path.join(directory,'flanks.txt')
+        with open(flanks_path,'w') as out_stream:
+            out_stream.write("2=GG[A/T]CC\n1=AAAA[C/G]TTTT\n")
+        # makeblastdb is only needed to build the database, so write the files of a bundle by hand
+        bundle_dir = os.path.join(directory,get_panel_key(['1','2'],get_file_source(flanks_path)))
+        os.makedirs(bundle_dir)
+        assert( not is_bundle(bundle_dir) )
+        with open(os.path.join(bundle_dir,'snp_info.txt'),'w') as out_stream:
+            out_stream.write("1 4 5 1\n2 2 3 1\n")
+        with open(os.path.join(bundle_dir,ACCESSION_MAP_NAME),'w') as out_stream:
+            out_stream.write("0\t1\n1\t2\n")
+        with open(os.path.join(bundle_dir,MANIFEST_NAME),'w') as out_stream:
+            json.dump({'version':PANEL_VERSION},out_stream)
+        assert( is_bundle(bundle_dir) )
+        # The existing bundle is found from the same flanks without building anything
+        assert( build_panel(directory,flanks_path=flanks_path) == bundle_dir )
+        panel = load_panel(bundle_dir)
+        assert( panel['accession_map'] == {'0':'1','1':'2'} )
+        assert( panel['var_info']['1'] == {'start':4,'stop':5,'length':1} )
+
+        # Build a bundle from scratch, with makeblastdb stubbed out
+        import psst
+        run_command = psst.run_command
+        def fake_makeblastdb(name,accession,command,report_dir):
+            open(os.path.join(command[2],'snp_flanks.nsq'),'w').close()
+            return 0
+        def failed_makeblastdb(name,accession,command,report_dir):
+            return 1
+        panels_dir = os.path.join(directory,'panels')
+        try:
+            # A failed build leaves nothing behind
+            psst.run_command = failed_makeblastdb
+            try:
+                build_panel(panels_dir,flanks_path=flanks_path)
+                assert( False )
+            except Exception:
+                pass
+            assert( os.listdir(panels_dir) == [] )
+            psst.run_command = fake_makeblastdb
+            built_dir = build_panel(panels_dir,flanks_path=flanks_path)
+        finally:
+            psst.run_command = run_command
+        assert( os.listdir(panels_dir) == [os.path.basename(built_dir)] )
+        manifest = read_manifest(built_dir)
+        assert( manifest['snp_accessions'] == ['1','2'] and manifest['snps_found'] == 2 )
+        assert( sorted(manifest['files']) == sorted(os.listdir(built_dir)) )
+        panel = load_panel(built_dir)
+        assert( panel['accession_map'] == {'0':'1','1':'2'} )
+        assert( sorted(panel['var_info']) == ['1','2'] )
+    finally:
+        shutil.rmtree(directory)
+    print("All unit tests passed!")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+    '''
+    Builds reusable SNP panel bundles. 'build' fetches the flanking sequences of a list of SNP accessions, finds
+    the variant information and builds the BLAST database once, into a bundle named after a hash of the sorted
+    accessions and the flank source; building the same panel again returns the existing bundle. The bundle
+    directory can then be given to psst.sh with '-n' in place of the SNP accessions file. 'info' prints the
+    manifest of a bundle.
+    ''')
+    parser.add_argument('-t','--test',action='store_true',help='Perform unit tests for this script.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    build_parser = subparsers.add_parser('build',help='Build the bundle of a SNP panel, or find the existing one.')
+    build_parser.add_argument('-n','--snps',help='Path to the SNP accessions file.')
+    build_parser.add_argument('-l','--flanks',help='Path to a flanking sequences file to use instead of Entrez.')
+    build_parser.add_argument('-e','--email',help='Email address for Entrez.')
+    build_parser.add_argument('-d','--dir',required=True,help='Directory holding the bundles.')
+
+    info_parser = subparsers.add_parser('info',help='Print the manifest of a bundle.')
+    info_parser.add_argument('bundle',help='Path to the bundle directory.')
+    args = parser.parse_args()
+
+    if args.test:
+        unit_tests()
+        sys.exit(0)
+
+    if args.command == 'build':
+        if (args.snps is None) == (args.flanks is None):
+            parser.error("please provide exactly one of a SNP accessions file or a flanking sequences file.")
+        if args.snps is not None and args.email is None:
+            parser.error("please provide an email address for Entrez.")
+        accessions = None
+        if args.snps is not None:
+            with open(args.snps,'r') as in_stream:
+                accessions = in_stream.readlines()
+        print( build_panel(args.dir,accessions,args.email,args.flanks) )
+    elif args.command == 'info':
+        manifest = read_manifest(args.bundle)
+        if manifest is None:
+            print("Error: %s is not a SNP panel bundle of version %d." % (args.bundle,PANEL_VERSION))
+            sys.exit(1)
+        print( json.dumps(manifest,indent=2,sort_keys=True) )
+    else:
+        parser.print_help()
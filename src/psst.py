@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+from run_report import start_stage, end_stage, count, run_command, merge_report
+from run_report import REPORT_DIR_VAR, PROFILE_VAR, REPORT_NAME
+
+# Global variables are depicted in all uppercase
+SRC = os.path.dirname(os.path.abspath(__file__)) # Directory containing the PSST scripts
+DB_NAME = 'snp_flanks' # Name of the BLAST database built out of the SNP flanking sequences
+
+# The stage modules are imported inside the stage functions so that their dependencies, e.g. Biopython, are
+# only loaded when the stage actually runs.
+
+def read_accessions(path):
+    '''
+    Reads a file with one accession per line
+    Inputs
+    - (str) path: path to the accessions file
+    Outputs
+    - accessions: the list of accessions, without blank lines
+    '''
+    accessions = []
+    with open(path,'r') as in_stream:
+        for line in in_stream:
+            accession = line.strip()
+            if len(accession) > 0:
+                accessions.append(accession)
+    return accessions
+
+def find_flanks(snp_accessions,email,working_dir,keep_files):
+    '''
+    Retrieves the flanking sequences of the SNPs from Entrez
+    Inputs
+    - (list) snp_accessions: the SNP accessions
+    - (str) email: email address to give to Entrez
+    - (str) working_dir: the working directory
+    - (bool) keep_files: whether to write the flanking sequences to snp_flanks.txt
+    Outputs
+    - flanking_sequences: a dict where the keys are SNP accessions and the values are flanking sequences
+    '''
+    from get_var_flanks import get_var_flanking_sequences, write_flanking_sequences
+    stage = start_stage('get_var_flanks')
+    flanking_sequences = get_var_flanking_sequences(snp_accessions,email)
+    if keep_files:
+        write_flanking_sequences(flanking_sequences,os.path.join(working_dir,'snp_flanks.txt'))
+    count(stage,'snps_requested',len(snp_accessions))
+    count(stage,'snps_fetched',len(flanking_sequences))
+    end_stage(stage)
+    return flanking_sequences
+
+def find_info(flanking_sequences,working_dir,keep_files):
+    '''
+    Finds the start and stop positions of each variant in its flanking sequence
+    Inputs
+    - flanking_sequences: a dict where the keys are SNP accessions and the values are flanking sequences
+    - (str) working_dir: the working directory
+    - (bool) keep_files: whether to write the variant information to snp_info.txt
+    Outputs
+    - var_info: a dict where the keys are SNP accessions and the values are dicts with the start and stop
+                positions of the variant and the length of the allele, as expected by call_variants.py
+    '''
+    from find_var_info import find_var_info
+    stage = start_stage('find_var_info')
+    var_info = {}
+    positions = find_var_info(flanking_sequences)
+    for var_acc in positions:
+        start, stop, length = positions[var_acc]
+        var_info[var_acc] = {'start':start,'stop':stop,'length':length}
+    if keep_files:
+        with open(os.path.join(working_dir,'snp_info.txt'),'w') as output_stream:
+            for var_acc in sorted(var_info):
+                info = var_info[var_acc]
+                output_stream.write( "%s %d %d %d\n" % (var_acc,info['start'],info['stop'],info['length']) )
+    count(stage,'snps',len(var_info))
+    end_stage(stage)
+    return var_info
+
+def build_reference(flanking_sequences,working_dir):
+    '''
+    Writes the flanking sequences into a FASTA file and builds a BLAST database out of it
+    Inputs
+    - flanking_sequences: a dict where the keys are SNP accessions and the values are flanking sequences
+    - (str) working_dir: the working directory
+    Outputs
+    - accession_map: the map from Magic-BLAST reference labels to SNP accessions
+    '''
+    from var_flanks_to_fasta import write_fasta
+    stage = start_stage('var_flanks_to_fasta')
+    fasta_path = os.path.join(working_dir,DB_NAME + '.fasta')
+    accessions = write_fasta( sorted(flanking_sequences.items()), fasta_path, stage )
+    end_stage(stage)
+    returncode = run_command( 'makeblastdb', None, [os.path.join(SRC,'makeblastdb.sh'),fasta_path,working_dir],\
+                              os.environ.get(REPORT_DIR_VAR) )
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode,'makeblastdb.sh')
+    accession_map = {}
+    for id_number, accession in enumerate(accessions):
+        accession_map[str(id_number)] = accession
+    return accession_map
+
+def load_reference(reference_dir):
+    '''
+    Loads the SNP reference of a previous run, as psst.sh -r does. The run must have kept snp_info.txt, which
+    psst.sh always does and psst.py does with -k.
+    Inputs
+    - (str) reference_dir: the working directory of the previous run
+    Outputs
+    - a pair with the variant information and the accession map
+    '''
+    from call_variants import get_var_info, get_accession_map
+    info_path = os.path.join(reference_dir,'snp_info.txt')
+    if not os.path.isfile(info_path):
+        raise IOError("%s has no snp_info.txt; build the reference with psst.sh or with psst.py -k" % (reference_dir))
+    return ( get_var_info(info_path), get_accession_map(os.path.join(reference_dir,DB_NAME + '.fasta')) )
+
+def align(sra_path,fastq_path,working_dir,threads,procs,collapse=False,stop_depth=None,batch_bytes=None,\
+          reference_dir=None):
+    '''
+    Aligns either the SRA datasets or the FASTQ file onto the BLAST database with Magic-BLAST
+    Inputs
+    - (str) sra_path: path to the SRA accessions file, or None
+    - (str) fastq_path: path to the FASTQ file, or None
+    - (str) working_dir: the working directory
+    - (int) threads: number of threads per Magic-BLAST run
+    - (int) procs: maximum number of concurrent Magic-BLAST runs
+    - (bool) collapse: whether to collapse identical reads before alignment, see collapse_reads.py
+    - (int) stop_depth: if set, the alignment of a dataset stops once the call of every variant is settled at
+                        this number of spanning reads, see early_stop.py. snp_info.txt must be in reference_dir.
+    - (int) batch_bytes: if set, SRA datasets smaller than half of it are aligned together in batches of at most
+                         this many bytes, see batch_sra.py
+    - (str) reference_dir: the directory holding the SNP reference, working_dir if None
+    Outputs
+    - (str) mbo_dir: the directory containing the Magic-BLAST output files
+    '''
+    mbo_dir = os.path.join(working_dir,'mbo')
+    if not os.path.isdir(mbo_dir):
+        os.makedirs(mbo_dir)
+    if sra_path is not None:
+        command = [os.path.join(SRC,'magicblast_sra.sh'),sra_path,DB_NAME,mbo_dir,str(threads),str(procs)]
+    else:
+        command = [os.path.join(SRC,'magicblast_fastq.sh'),fastq_path,DB_NAME,mbo_dir,str(threads)]
+    command.append( str(int(collapse)) )
+    env = os.environ.copy()
+    if reference_dir is None:
+        reference_dir = working_dir
+    if stop_depth is not None:
+        from early_stop import STOP_DEPTH_VAR, SNP_INFO_VAR, SNP_FASTA_VAR
+        env[STOP_DEPTH_VAR] = str(stop_depth)
+        env[SNP_INFO_VAR] = os.path.join(reference_dir,'snp_info.txt')
+        env[SNP_FASTA_VAR] = os.path.join(reference_dir,DB_NAME + '.fasta')
+    if batch_bytes is not None:
+        from batch_sra import BATCH_BYTES_VAR
+        env[BATCH_BYTES_VAR] = str(batch_bytes)
+    subprocess.check_call(command,env=env)
+    return mbo_dir
+
+def call(mbo_dir,accession_map,var_info,threads,output_path,output_format='tsv',sort=False,early_stop=False):
+    '''
+    Calls the variants in each aligned dataset and writes the results of each dataset as soon as it is called.
+    The per-variant counts, the variant co-occurrence matrix and the read evidence table are written next to the
+    result file.
+    Inputs
+    - (str) mbo_dir: the directory containing the Magic-BLAST output files
+    - accession_map: the map from Magic-BLAST reference labels to SNP accessions
+    - var_info: the variant information as returned by find_info
+    - (int) threads: the maximum number of threads
+    - (str) output_path: path of the result file
+    - (str) output_format: one of the formats supported by result_sink.py
+    - (bool) sort: whether to order the results by accession
+    - (bool) early_stop: whether the alignments may have been stopped early, see open_sink in result_sink.py
+    Outputs
+    - variants: dict where the keys are SRA accessions and the value is another dict that contains the homozgyous and
+                heterozygous variants in separate lists
+    '''
+    from call_variants import get_mbo_paths, call_all_variants, count_variants, create_variant_matrix
+    from call_variants import write_variant_counts, write_variant_matrix
+    from result_sink import open_sink, close_sink
+    from evidence import open_evidence, close_evidence, EVIDENCE_NAME
+    stage = start_stage('call_variants')
+    paths = get_mbo_paths(mbo_dir)
+    output_dir = os.path.dirname(output_path)
+    sink = open_sink(output_path,output_format,sort,early_stop)
+    evidence = open_evidence( os.path.join(output_dir,EVIDENCE_NAME) )
+    variants = call_all_variants(paths,accession_map,var_info,threads,stage,sink,evidence)
+    close_sink(sink)
+    close_evidence(evidence)
+    write_variant_counts( count_variants(variants), os.path.join(output_dir,'variant_counts.tsv') )
+    write_variant_matrix( create_variant_matrix(variants), os.path.join(output_dir,'variant_matrix.tsv') )
+    end_stage(stage)
+    return variants
+
+def run(snp_path,sra_path,fastq_path,working_dir,email,threads,procs,keep_files=False,output_format='tsv',\
+        sort=False,collapse=False,stop_depth=None,batch_bytes=None,reference_dir=None):
+    '''
+    Runs the whole PSST pipeline in a single process; see psst.sh for the description of each stage
+    Inputs
+    - (str) snp_path: path to the SNP accessions file, or to a SNP panel bundle built by panel.py, in which case
+                      the SNP reference is loaded from the bundle instead of being built; not needed with
+                      reference_dir
+    - (str) sra_path: path to the SRA accessions file, or None
+    - (str) fastq_path: path to the FASTQ file, or None
+    - (str) working_dir: the working directory
+    - (str) email: email address to give to Entrez, not needed with a bundle
+    - (int) threads: number of threads per Magic-BLAST run
+    - (int) procs: maximum number of concurrent Magic-BLAST runs
+    - (bool) keep_files: whether to write snp_flanks.txt and snp_info.txt into the working directory
+    - (str) output_format: one of the formats supported by result_sink.py
+    - (bool) sort: whether to order the results by accession
+    - (bool) collapse: whether to collapse identical reads before alignment
+    - (int) stop_depth: if set, stop aligning a dataset once every call is settled at this read depth
+    - (int) batch_bytes: if set, align small SRA datasets together in batches of at most this many bytes
+    - (str) reference_dir: if set, the working directory of a previous run whose SNP reference is reused, see
+                           load_reference
+    Outputs
+    - (str) the path to the result file
+    '''
+    from panel import is_bundle
+    working_dir = os.path.abspath(working_dir)
+    if not os.path.isdir(working_dir):
+        os.makedirs(working_dir)
+    report_dir = os.path.join(working_dir,'report')
+    if os.path.isdir(report_dir):
+        shutil.rmtree(report_dir) # Discard the records of previous runs
+    os.environ[REPORT_DIR_VAR] = report_dir
+
+    if reference_dir is not None:
+        reference_dir = os.path.abspath(reference_dir)
+        print("Using the SNP reference in %s..." % (reference_dir))
+        var_info, accession_map = load_reference(reference_dir)
+    elif is_bundle(snp_path):
+        from panel import load_panel
+        print("Using the SNP panel bundle in %s..." % (snp_path))
+        panel = load_panel(snp_path)
+        var_info = panel['var_info']
+        accession_map = panel['accession_map']
+        reference_dir = panel['dir']
+    else:
+        print("Finding SNP flanking sequences...")
+        flanking_sequences = find_flanks(read_accessions(snp_path),email,working_dir,keep_files)
+        print("Getting SNP flank information...")
+        var_info = find_info(flanking_sequences,working_dir,keep_files or stop_depth is not None)
+        print("Creating a BLAST database out of the SNP flanking sequences...")
+        accession_map = build_reference(flanking_sequences,working_dir)
+        reference_dir = working_dir
+    os.environ['BLASTDB'] = reference_dir
+    print("Aligning SRA datasets onto the SNPs...")
+    mbo_dir = align(sra_path,fastq_path,working_dir,threads,procs,collapse,stop_depth,batch_bytes,reference_dir)
+    print("Calling SNPs...")
+    result_path = os.path.join(working_dir,'results.' + output_format)
+    call(mbo_dir,accession_map,var_info,threads * procs,result_path,output_format,sort,stop_depth is not None)
+    merge_report(report_dir,os.path.join(working_dir,REPORT_NAME))
+    return result_path
+
+if __name__ == "__main__":
+    help_message = "Description: Given a text file of SNP accessions and either another text file of SRA accessions\n" \
+                 + "             or a FASTQ file of NGS reads, determines the set of SNPs that occur in the\n" \
+                 + "             dataset(s). Unlike psst.sh, all stages run in a single Python process."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-s <SRA accessions file>]\n" % (sys.argv[0]) \
+                  + "[-n <SNP accessions file or SNP panel bundle, see panel.py>]\n[-f <FASTQ file>]\n[-d <working directory>]\n" \
+                  + "[-e <email for Entrez>]\n[-t <threads per Magic-BLAST run>]\n" \
+                  + "[-p <max number of Magic-BLAST runs>]\n[-P <profiler, either 'cprofile' or 'sample'>]\n" \
+                  + "[-k <keep intermediate files>]\n[-F <result format, one of tsv, jsonl or parquet>]\n" \
+                  + "[-S <sort the results by accession>]\n" \
+                  + "[-c <collapse identical reads before alignment, single-end data only>]\n" \
+                  + "[-D <stop aligning a dataset once every SNP call is settled at this read depth>]\n" \
+                  + "[-b <align small SRA datasets together in batches of at most this many bytes>]\n" \
+                  + "[-r <working directory of a previous run whose SNP reference should be reused>]\n" \
+                  + "With -r, the SNP reference is not rebuilt, so -n and -e are not needed."
+    options = "hkScs:f:n:d:e:t:p:P:F:D:b:r:"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    if len(sys.argv) == 1:
+        print(help_message)
+        print(usage_message)
+        sys.exit()
+
+    sra_path = None
+    fastq_path = None
+    snp_path = None
+    working_dir = None
+    email = None
+    threads = None
+    procs = None
+    profile = None
+    keep_files = False
+    output_format = 'tsv'
+    sort = False
+    collapse = False
+    stop_depth = None
+    batch_bytes = None
+    reference_dir = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-s':
+            sra_path = arg
+        elif opt == '-f':
+            fastq_path = arg
+        elif opt == '-n':
+            snp_path = arg
+        elif opt == '-d':
+            working_dir = arg
+        elif opt == '-e':
+            email = arg
+        elif opt == '-t':
+            threads = int(arg)
+        elif opt == '-p':
+            procs = int(arg)
+        elif opt == '-P':
+            profile = arg
+        elif opt == '-k':
+            keep_files = True
+        elif opt == '-F':
+            output_format = arg
+        elif opt == '-S':
+            sort = True
+        elif opt == '-c':
+            collapse = True
+        elif opt == '-D':
+            stop_depth = int(arg)
+        elif opt == '-b':
+            batch_bytes = int(arg)
+        elif opt == '-r':
+            reference_dir = arg
+
+    opts_incomplete = False
+
+    if sra_path == None and fastq_path == None:
+        print("Error: please provide either an SRA accessions file or a FASTQ file.")
+        opts_incomplete = True
+    if sra_path != None and fastq_path != None:
+        print("Error: please provide only one of either an SRA accessions file or a FASTQ file.")
+        opts_incomplete = True
+    if snp_path == None and reference_dir == None:
+        print("Error: please provide a SNP accessions file.")
+        opts_incomplete = True
+    if working_dir == None:
+        print("Error: please specify a working directory.")
+        opts_incomplete = True
+    if email == None and reference_dir == None and not (snp_path != None and os.path.isdir(snp_path)):
+        print("Error: please provide an email address for Entrez.")
+        opts_incomplete = True
+    if threads == None:
+        print("Error: please specify the number of threads to give to each Magic-BLAST run.")
+        opts_incomplete = True
+    if procs == None:
+        print("Error: please specify the maximum number of child processes for this program.")
+        opts_incomplete = True
+    if profile != None and profile not in ['cprofile','sample']:
+        print("Error: the profiler must be either 'cprofile' or 'sample'.")
+        opts_incomplete = True
+    if output_format not in ['tsv','jsonl','parquet']:
+        print("Error: the result format must be one of tsv, jsonl or parquet.")
+        opts_incomplete = True
+    if stop_depth != None and stop_depth < 1:
+        print("Error: the read depth must be a positive integer.")
+        opts_incomplete = True
+    if stop_depth != None and collapse:
+        print("Error: -D cannot be combined with -c.")
+        opts_incomplete = True
+    if batch_bytes != None and batch_bytes < 1:
+        print("Error: the batch size must be a positive number of bytes.")
+        opts_incomplete = True
+    if opts_incomplete:
+        print(usage_message)
+        sys.exit(1)
+
+    if profile != None:
+        os.environ[PROFILE_VAR] = profile
+    result_path = run(snp_path,sra_path,fastq_path,working_dir,email,threads,procs,keep_files,output_format,sort,\
+                      collapse,stop_depth,batch_bytes,reference_dir)
+    print("PSST run complete. Result file can be found at:")
+    print(result_path)
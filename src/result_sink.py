@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import heapq
+import json
+import os
+import shutil
+import sys
+
+# Global variables are depicted in all uppercase
+FORMATS = ['tsv','jsonl','parquet'] # Supported output formats
+PARTIAL_SUFFIX = '.partial' # Results are appended to this file until the sink is closed
+BUFFER_SIZE = 1 << 16 # Size in bytes of the write buffer of the text formats
+PARQUET_BATCH = 256 # Number of SRA datasets per Parquet part file, see open_sink
+PARTS_SUFFIX = '.parts' # Directory holding the Parquet part files until the sink is closed
+PART_NAME = 'part_%06d.parquet'
+MERGE_ROWS = 1 << 16 # Number of rows read from each part at a time and written per row group when merging parts
+TSV_HEADER = "SRA\tHeterozygous SNPs\tHomozygous SNPs\n"
+TRUNCATED_COLUMN = "Truncated" # Column added to the TSV results when alignments may have been stopped early
+
+def get_format(path):
+    '''
+    Guesses the output format from the extension of the output path, defaulting to TSV
+    '''
+    extension = os.path.splitext(path)[1].lstrip('.')
+    if extension in FORMATS:
+        return extension
+    return 'tsv'
+
+def open_sink(path,fmt='tsv',sort=False,early_stop=False):
+    '''
+    Opens a result sink. TSV and JSONL results are appended to '<path>.partial' as soon as they are written, so
+    that the results of the datasets called so far survive if the run dies. A Parquet file is only readable once
+    its footer is written, so Parquet results are written every PARQUET_BATCH datasets as a complete part file in
+    '<path>.parts' instead, and only the datasets since the last part are lost if the run dies. close_sink merges
+    the parts into one file. The final file only appears at path once close_sink is called.
+    Inputs
+    - (str) path: path of the final output file
+    - (str) fmt: one of 'tsv', 'jsonl' or 'parquet'
+    - (bool) sort: whether to sort the SRA datasets and the variants within each of them, so that the output
+                   does not depend on the order in which the datasets finished
+    - (bool) early_stop: whether alignments may have been stopped early by early_stop.py, which adds the
+                         TRUNCATED_COLUMN to TSV results; the other formats always record it
+    Outputs
+    - sink: a dict to pass to write_result and close_sink
+    '''
+    if fmt not in FORMATS:
+        raise ValueError("Unknown result format '%s', expected one of %s" % (fmt,', '.join(FORMATS)))
+    sink = {'path':path,'partial_path':path + PARTIAL_SUFFIX,'format':fmt,'sort':sort,'early_stop':early_stop}
+    if fmt == 'parquet':
+        # pyarrow is an optional dependency that is only needed for this format
+        import pyarrow
+        import pyarrow.parquet
+        sink['schema'] = pyarrow.schema([('sra',pyarrow.string()),('snp',pyarrow.string()),\
+                                         ('genotype',pyarrow.string()),('true_reads',pyarrow.int64()),\
+                                         ('false_reads',pyarrow.int64()),('truncated',pyarrow.bool_())])
+        sink['parts_dir'] = path + PARTS_SUFFIX
+        if os.path.isdir(sink['parts_dir']):
+            shutil.rmtree(sink['parts_dir']) # Left over by a previous run, like a partial text file
+        os.makedirs(sink['parts_dir'])
+        sink['parts'] = []
+        sink['columns'] = dict( [(name,[]) for name in sink['schema'].names] )
+        sink['batched'] = 0
+    else:
+        sink['stream'] = open(sink['partial_path'],'w',BUFFER_SIZE)
+        if fmt == 'tsv' and early_stop:
+            sink['stream'].write( TSV_HEADER.rstrip('\n') + '\t' + TRUNCATED_COLUMN + '\n' )
+        elif fmt == 'tsv':
+            sink['stream'].write(TSV_HEADER)
+    return sink
+
+def get_genotypes(sra_variants):
+    '''
+    Returns a dict where the keys are the variants called in a dataset and the values are their genotypes
+    '''
+    genotypes = {}
+    for genotype in ['heterozygous','homozygous']:
+        for var_acc in sra_variants.get(genotype,[]):
+            genotypes[var_acc] = genotype
+    return genotypes
+
+def write_result(sink,sra_acc,sra_variants):
+    '''
+    Appends the variants called in one SRA dataset to the sink
+    Inputs
+    - sink: the dict returned by open_sink
+    - (str) sra_acc: the SRA accession
+    - sra_variants: a dict that contains the homozygous and heterozygous variants in separate lists and,
+                    optionally, the read depth of each variant as returned by call_variants in call_variants.py
+                    and whether the alignment of the dataset was stopped early by early_stop.py ('truncated')
+    '''
+    heterozygous = sra_variants.get('heterozygous',[])
+    homozygous = sra_variants.get('homozygous',[])
+    depth = sra_variants.get('depth',{})
+    truncated = bool( sra_variants.get('truncated',False) )
+    if sink['sort']:
+        heterozygous = sorted(heterozygous)
+        homozygous = sorted(homozygous)
+    fmt = sink['format']
+    if fmt == 'tsv' and sink['early_stop']:
+        sink['stream'].write( "%s\t%s\t%s\t%s\n" % (sra_acc,','.join(heterozygous),','.join(homozygous),\
+                                                     'yes' if truncated else 'no') )
+    elif fmt == 'tsv':
+        sink['stream'].write( "%s\t%s\t%s\n" % (sra_acc,','.join(heterozygous),','.join(homozygous)) )
+    elif fmt == 'jsonl':
+        record = {'sra':sra_acc,'heterozygous':heterozygous,'homozygous':homozygous,'depth':depth,\
+                  'truncated':truncated}
+        sink['stream'].write( json.dumps(record,sort_keys=True) + "\n" )
+    else:
+        genotypes = get_genotypes(sra_variants)
+        columns = sink['columns']
+        for var_acc in sorted( set(depth) | set(genotypes) ):
+            frequencies = depth.get(var_acc,{})
+            columns['sra'].append(sra_acc)
+            columns['snp'].append(var_acc)
+            columns['genotype'].append(genotypes.get(var_acc))
+            columns['true_reads'].append(frequencies.get('true',0))
+            columns['false_reads'].append(frequencies.get('false',0))
+            columns['truncated'].append(truncated)
+        sink['batched'] += 1
+        if sink['batched'] >= PARQUET_BATCH:
+            flush_parquet(sink)
+    if fmt != 'parquet':
+        # Make the result visible in the partial file before moving on to the next dataset
+        sink['stream'].flush()
+
+def flush_parquet(sink):
+    '''
+    Writes the buffered Parquet rows of a sink as a new part file, sorted if the sink is. The part is written
+    under a temporary name and renamed, so that every part file in the parts directory is complete.
+    '''
+    import pyarrow
+    import pyarrow.parquet
+    if sink['batched'] > 0:
+        table = pyarrow.Table.from_pydict(sink['columns'],schema=sink['schema'])
+        if sink['sort']:
+            table = table.sort_by([('sra','ascending'),('snp','ascending')])
+        part_path = os.path.join( sink['parts_dir'], PART_NAME % (len(sink['parts'])) )
+        pyarrow.parquet.write_table(table,part_path + PARTIAL_SUFFIX,compression='zstd')
+        replace(part_path + PARTIAL_SUFFIX,part_path)
+        sink['parts'].append(part_path)
+        for name in sink['columns']:
+            sink['columns'][name] = []
+        sink['batched'] = 0
+
+def read_part_rows(path,names):
+    '''
+    Yields ((sra, snp), row) pairs for each row of a Parquet part file, a batch of rows at a time, so that several
+    sorted parts can be merged with heapq.merge
+    '''
+    import pyarrow.parquet
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=MERGE_ROWS):
+        columns = batch.to_pydict()
+        for row in zip(*[columns[name] for name in names]):
+            yield ( (row[0],row[1]), row )
+
+def merge_parts(sink):
+    '''
+    Merges the part files of a Parquet sink into its partial file, in order of SRA accession and SNP if the sink
+    is sorted and in the order they were written otherwise. Only a batch of rows per part is held in memory.
+    '''
+    import pyarrow
+    import pyarrow.parquet
+    names = sink['schema'].names
+    writer = pyarrow.parquet.ParquetWriter(sink['partial_path'],sink['schema'],compression='zstd')
+    if sink['sort']:
+        columns = dict( [(name,[]) for name in names] )
+        num_rows = 0
+        for key, row in heapq.merge(*[read_part_rows(path,names) for path in sink['parts']]):
+            for name, value in zip(names,row):
+                columns[name].append(value)
+            num_rows += 1
+            if num_rows >= MERGE_ROWS:
+                writer.write_table( pyarrow.Table.from_pydict(columns,schema=sink['schema']) )
+                columns = dict( [(name,[]) for name in names] )
+                num_rows = 0
+        if num_rows > 0 or len(sink['parts']) == 0:
+            writer.write_table( pyarrow.Table.from_pydict(columns,schema=sink['schema']) )
+    else:
+        for path in sink['parts']:
+            writer.write_table( pyarrow.parquet.read_table(path) )
+        if len(sink['parts']) == 0:
+            writer.write_table( pyarrow.Table.from_pydict(dict([(name,[]) for name in names]),schema=sink['schema']) )
+    writer.close()
+
+def replace(source_path,destination_path):
+    '''
+    Atomically moves a file over another one
+    '''
+    if hasattr(os,'replace'):
+        os.replace(source_path,destination_path)
+    else: # Python 2 only has rename, which is atomic on POSIX
+        os.rename(source_path,destination_path)
+
+def sort_lines(sink):
+    '''
+    Rewrites the partial file of a text sink with its results ordered by SRA accession
+    '''
+    with open(sink['partial_path'],'r') as partial:
+        lines = partial.readlines()
+    header = []
+    if sink['format'] == 'tsv':
+        header = lines[:1]
+        lines = sorted( lines[1:], key=lambda line: line.split('\t',1)[0] )
+    else:
+        lines = sorted( lines, key=lambda line: json.loads(line)['sra'] )
+    sorted_path = sink['partial_path'] + '.sorted'
+    with open(sorted_path,'w',BUFFER_SIZE) as output:
+        output.writelines(header + lines)
+        output.flush()
+        os.fsync(output.fileno())
+    replace(sorted_path,sink['partial_path'])
+
+def close_sink(sink):
+    '''
+    Finalizes a sink: sorts its results if requested and atomically moves the partial file to the output path
+    '''
+    if sink['format'] == 'parquet':
+        flush_parquet(sink)
+        merge_parts(sink)
+    else:
+        sink['stream'].flush()
+        os.fsync(sink['stream'].fileno())
+        sink['stream'].close()
+        if sink['sort']:
+            sort_lines(sink)
+    replace(sink['partial_path'],sink['path'])
+    if sink['format'] == 'parquet':
+        shutil.rmtree(sink['parts_dir'])
+
+def unit_tests():
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    results = [('SRR2',{'heterozygous':['b','a'],'homozygous':[],'depth':{'a':{'true':2,'false':2},\
+                'b':{'true':1,'false':1}}}),('SRR1',{'heterozygous':[],'homozygous':['c'],\
+                'depth':{'c':{'true':5,'false':0},'d':{'true':0,'false':3}},'truncated':True})]
+    try:
+        path = os.path.join(directory,'results.tsv')
+        sink = open_sink(path,'tsv',sort=True)
+        write_result(sink,*results[0])
+        # The first result is readable before the sink is closed
+        with open(path + PARTIAL_SUFFIX,'r') as partial:
+            assert( partial.readlines()[1] == "SRR2\ta,b\t\n" )
+        write_result(sink,*results[1])
+        close_sink(sink)
+        assert( not os.path.exists(path + PARTIAL_SUFFIX) )
+        with open(path,'r') as tsv:
+            assert( tsv.read() == TSV_HEADER + "SRR1\t\tc\nSRR2\ta,b\t\n" )
+        # With early stopping, the TSV results say which datasets were truncated
+        sink = open_sink(path,'tsv',sort=True,early_stop=True)
+        for sra_acc, sra_variants in results:
+            write_result(sink,sra_acc,sra_variants)
+        close_sink(sink)
+        with open(path,'r') as tsv:
+            assert( tsv.read() == "SRA\tHeterozygous SNPs\tHomozygous SNPs\tTruncated\n" \
+                                  + "SRR1\t\tc\tyes\nSRR2\ta,b\t\tno\n" )
+
+        path = os.path.join(directory,'results.jsonl')
+        sink = open_sink(path,get_format(path),sort=True)
+        for sra_acc, sra_variants in results:
+            write_result(sink,sra_acc,sra_variants)
+        close_sink(sink)
+        with open(path,'r') as jsonl:
+            records = [json.loads(line) for line in jsonl]
+        assert( [record['sra'] for record in records] == ['SRR1','SRR2'] )
+        assert( records[0]['depth']['d'] == {'true':0,'false':3} )
+        assert( records[0]['truncated'] and not records[1]['truncated'] )
+
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            print("pyarrow is not installed, skipping the Parquet tests.")
+        else:
+            global PARQUET_BATCH
+            default_batch = PARQUET_BATCH
+            path = os.path.join(directory,'results.parquet')
+            for batch in [default_batch,1]:
+                # With one dataset per part, the first result is readable before the sink is closed and the
+                # parts are merged in order of accession
+                PARQUET_BATCH = batch
+                sink = open_sink(path,'parquet',sort=True)
+                for sra_acc, sra_variants in results:
+                    write_result(sink,sra_acc,sra_variants)
+                    if batch == 1 and sra_acc == 'SRR2':
+                        part = pyarrow.parquet.read_table( os.path.join(path + PARTS_SUFFIX,PART_NAME % (0)) )
+                        assert( part.to_pydict()['sra'] == ['SRR2','SRR2'] )
+                close_sink(sink)
+                assert( not os.path.exists(path + PARTS_SUFFIX) )
+                table = pyarrow.parquet.read_table(path).to_pydict()
+                assert( table['sra'] == ['SRR1','SRR1','SRR2','SRR2'] )
+                assert( table['genotype'] == ['homozygous',None,'heterozygous','heterozygous'] )
+                assert( table['false_reads'] == [0,3,2,1] )
+                assert( table['truncated'] == [True,True,False,False] )
+            PARQUET_BATCH = default_batch
+            # Without sorting, the parts are concatenated in the order they were written
+            sink = open_sink(path,'parquet')
+            for sra_acc, sra_variants in results:
+                write_result(sink,sra_acc,sra_variants)
+            close_sink(sink)
+            assert( pyarrow.parquet.read_table(path).to_pydict()['sra'] == ['SRR2','SRR2','SRR1','SRR1'] )
+    finally:
+        shutil.rmtree(directory)
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == '-t':
+        unit_tests()
+    else:
+        print("Usage: %s [-t <unit tests>]" % (sys.argv[0]))
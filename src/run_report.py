@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import cProfile
+import getopt
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Global variables are depicted in all uppercase
+REPORT_DIR_VAR = 'PSST_REPORT_DIR' # Directory where each stage drops its report fragment
+PROFILE_VAR = 'PSST_PROFILE' # Either 'cprofile' or 'sample'; profiling is off if unset
+REPORT_NAME = 'run_report.json' # Name of the merged report in the working directory
+SAMPLE_INTERVAL = 0.005 # Seconds between two stack samples of the sampling profiler
+
+def get_report_dir():
+    '''
+    Returns the directory in which report fragments should be written, or None if reporting is disabled
+    '''
+    return os.environ.get(REPORT_DIR_VAR)
+
+def get_peak_memory(who):
+    '''
+    Returns the peak resident set size in kilobytes
+    Inputs
+    - who: either resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN
+    Outputs
+    - (int) the peak resident set size in kilobytes
+    '''
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes while macOS reports bytes
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+    return peak
+
+def get_cpu_time(children=False):
+    '''
+    Returns the user plus system CPU time consumed so far by this process or by its waited-for children
+    '''
+    times = os.times()
+    if children:
+        return times[2] + times[3]
+    return times[0] + times[1]
+
+def fragment_name(name,accession):
+    '''
+    Returns the file name (sans extension) of the fragment belonging to a stage and an optional accession
+    '''
+    if accession is None:
+        return name
+    return "%s.%s" % (name,accession)
+
+def start_sampler(interval=SAMPLE_INTERVAL):
+    '''
+    Starts a background thread that periodically samples the stacks of every other thread in the process.
+    Unlike cProfile, this also sees the work done by worker threads such as those of multiprocessing.dummy.
+    Outputs
+    - sampler: a dict with the stack counts, the sampling thread and an event used to stop it
+    '''
+    sampler = {'stacks':defaultdict(int),'stop':threading.Event()}
+    def sample():
+        own_id = threading.current_thread().ident
+        while not sampler['stop'].wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append( "%s:%s" % (os.path.basename(code.co_filename),code.co_name) )
+                    frame = frame.f_back
+                sampler['stacks'][ ';'.join(reversed(calls)) ] += 1
+    sampler['thread'] = threading.Thread(target=sample)
+    sampler['thread'].daemon = True
+    sampler['thread'].start()
+    return sampler
+
+def stop_sampler(sampler,output_path):
+    '''
+    Stops a sampler started by start_sampler and writes its samples in the folded stack format, which can be
+    given directly to flamegraph.pl or speedscope
+    '''
+    sampler['stop'].set()
+    sampler['thread'].join()
+    with open(output_path,'w') as folded:
+        for stack in sorted(sampler['stacks']):
+            folded.write( "%s %d\n" % (stack,sampler['stacks'][stack]) )
+
+def start_stage(name,accession=None,resources=True):
+    '''
+    Starts measuring a pipeline stage
+    Inputs
+    - (str) name: the name of the stage
+    - (str) accession: the accession the measurement is restricted to, if any
+    - (bool) resources: whether to measure CPU time and peak memory. These are process-wide, so per-accession
+                        measurements taken inside worker threads should only record wall time.
+    Outputs
+    - stage: a dict to pass to end_stage. Counters may be recorded in stage['counters'] in the meantime.
+    '''
+    stage = {'name':name,'accession':accession,'counters':{},'resources':resources,'profiler':None}
+    profile = os.environ.get(PROFILE_VAR)
+    if resources and profile and get_report_dir():
+        if profile == 'sample':
+            stage['profiler'] = start_sampler()
+        else:
+            stage['profiler'] = cProfile.Profile()
+            stage['profiler'].enable()
+    if resources:
+        stage['cpu_start'] = get_cpu_time()
+    stage['wall_start'] = time.time()
+    return stage
+
+def count(stage,counter,n=1):
+    '''
+    Increments a counter of a stage by n
+    '''
+    stage['counters'][counter] = stage['counters'].get(counter,0) + n
+
+def end_stage(stage):
+    '''
+    Finishes measuring a stage started by start_stage and writes its record to the report directory
+    Inputs
+    - stage: the dict returned by start_stage
+    Outputs
+    - record: a dict with the wall time, CPU time, peak memory and counters of the stage
+    '''
+    record = {'name':stage['name'],'accession':stage['accession'],'start':stage['wall_start'],\
+              'wall_seconds':time.time() - stage['wall_start'],'counters':stage['counters']}
+    if stage['resources']:
+        record['cpu_seconds'] = get_cpu_time() - stage['cpu_start']
+        record['peak_memory_kb'] = get_peak_memory(resource.RUSAGE_SELF)
+    profiler = stage['profiler']
+    if profiler is not None:
+        base = os.path.join( get_report_dir(), fragment_name(stage['name'],stage['accession']) )
+        if isinstance(profiler,dict):
+            stop_sampler(profiler,base + '.folded')
+        else:
+            profiler.disable()
+            profiler.dump_stats(base + '.prof')
+    write_record(record)
+    return record
+
+def write_record(record,report_dir=None):
+    '''
+    Writes a stage record as a JSON fragment. Does nothing if no report directory is given or set in the
+    environment.
+    '''
+    if report_dir is None:
+        report_dir = get_report_dir()
+    if report_dir is None:
+        return
+    if not os.path.isdir(report_dir):
+        try:
+            os.makedirs(report_dir)
+        except OSError: # Another stage may have created it concurrently
+            pass
+    path = os.path.join( report_dir, fragment_name(record['name'],record['accession']) + '.json' )
+    with open(path,'w') as fragment:
+        json.dump(record,fragment)
+
+def run_command(name,accession,command,report_dir):
+    '''
+    Runs an external command as a stage, measuring the wall time, CPU time and peak memory of the child process
+    Inputs
+    - (str) name: the name of the stage
+    - (str) accession: the accession the command processes, if any
+    - (list) command: the command and its arguments
+    - (str) report_dir: directory to write the record to
+    Outputs
+    - (int) the exit code of the command
+    '''
+    wall_start = time.time()
+    cpu_start = get_cpu_time(children=True)
+    returncode = subprocess.call(command)
+    record = {'name':name,'accession':accession,'start':wall_start,'wall_seconds':time.time() - wall_start,\
+              'cpu_seconds':get_cpu_time(children=True) - cpu_start,\
+              'peak_memory_kb':get_peak_memory(resource.RUSAGE_CHILDREN),'counters':{},'returncode':returncode}
+    write_record(record,report_dir)
+    return returncode
+
+def merge_report(report_dir,output_path):
+    '''
+    Merges the fragments in the report directory into a single JSON report. Stages appear in the order in which
+    they started; per-accession records are nested in their stage and sorted by accession.
+    Inputs
+    - (str) report_dir: the directory containing the fragments
+    - (str) output_path: path of the merged report
+    Outputs
+    - report: the merged report as a dict
+    '''
+    stages = {}
+    for file in sorted(os.listdir(report_dir)):
+        if not file.endswith('.json'):
+            continue
+        with open(os.path.join(report_dir,file),'r') as fragment:
+            record = json.load(fragment)
+        name = record['name']
+        if name not in stages:
+            stages[name] = {'name':name,'start':record['start'],'counters':{},'accessions':[]}
+        stage = stages[name]
+        stage['start'] = min(stage['start'],record['start'])
+        if record['accession'] is None:
+            accessions = stage['accessions']
+            stage.update(record)
+            stage['accessions'] = accessions
+        else:
+            stage['accessions'].append(record)
+    totals = {}
+    for name in stages:
+        stage = stages[name]
+        stage.pop('accession',None)
+        stage['accessions'].sort(key=lambda record: record['accession'])
+        # Stages measured only per accession, such as Magic-BLAST runs, get their totals from the accessions
+        if 'wall_seconds' not in stage and stage['accessions']:
+            accessions = stage['accessions']
+            stage['wall_seconds'] = max( [a['start'] + a['wall_seconds'] for a in accessions] ) - stage['start']
+            if all( ['cpu_seconds' in a for a in accessions] ):
+                stage['cpu_seconds'] = sum( [a['cpu_seconds'] for a in accessions] )
+                stage['peak_memory_kb'] = max( [a['peak_memory_kb'] for a in accessions] )
+        for counter in stage['counters']:
+            totals[counter] = totals.get(counter,0) + stage['counters'][counter]
+    report = {'stages':sorted(stages.values(),key=lambda stage: stage['start']),'counters':totals}
+    with open(output_path,'w') as output:
+        json.dump(report,output,indent=2,sort_keys=True)
+    return report
+
+def unit_tests():
+    import shutil
+    import tempfile
+    report_dir = tempfile.mkdtemp()
+    try:
+        os.environ[REPORT_DIR_VAR] = report_dir
+        os.environ[PROFILE_VAR] = 'sample'
+        stage = start_stage('stage_1')
+        count(stage,'reads',3)
+        count(stage,'reads')
+        sum( [i * i for i in range(100000)] )
+        end_stage(stage)
+        assert( os.path.exists(os.path.join(report_dir,'stage_1.folded')) )
+        for accession in ['SRR2','SRR1']:
+            stage = start_stage('stage_2',accession,resources=False)
+            count(stage,'reads',2)
+            end_stage(stage)
+        assert( run_command('stage_3','SRR1',[sys.executable,'-c','pass'],report_dir) == 0 )
+        report = merge_report(report_dir,os.path.join(report_dir,REPORT_NAME))
+        names = [stage['name'] for stage in report['stages']]
+        assert( names == ['stage_1','stage_2','stage_3'] )
+        assert( report['stages'][0]['counters']['reads'] == 4 )
+        assert( [a['accession'] for a in report['stages'][1]['accessions']] == ['SRR1','SRR2'] )
+        assert( 'cpu_seconds' in report['stages'][2] )
+        assert( report['counters']['reads'] == 4 )
+    finally:
+        del os.environ[REPORT_DIR_VAR]
+        del os.environ[PROFILE_VAR]
+        shutil.rmtree(report_dir)
+    print("All unit tests passed!")
+
+if __name__ == "__main__":
+    help_message = "Description: records the wall time, CPU time and peak memory of PSST pipeline stages.\n" \
+                 + "             Either runs a command as a stage and records it in the report directory, or\n" \
+                 + "             merges the records in the report directory into a single JSON report."
+    usage_message = "Usage: %s\n[-h (help and usage)]\n[-r <report directory>]\n" % (sys.argv[0]) \
+                  + "[-n <stage name> [-a <accession>] -- <command>]\n[-m <output path of the merged report>]\n" \
+                  + "[-t <unit tests>]"
+    options = "htr:n:a:m:"
+
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],options)
+    except getopt.GetoptError:
+        print("Error: unable to read command line arguments.")
+        sys.exit(1)
+
+    if len(sys.argv) == 1:
+        print(help_message)
+        print(usage_message)
+        sys.exit()
+
+    report_dir = None
+    name = None
+    accession = None
+    merged_path = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_message)
+            print(usage_message)
+            sys.exit(0)
+        elif opt == '-r':
+            report_dir = arg
+        elif opt == '-n':
+            name = arg
+        elif opt == '-a':
+            accession = arg
+        elif opt == '-m':
+            merged_path = arg
+        elif opt == '-t':
+            unit_tests()
+            sys.exit(0)
+
+    if report_dir == None:
+        print("Error: please provide the report directory.")
+        print(usage_message)
+        sys.exit(1)
+
+    if merged_path != None:
+        merge_report(report_dir,merged_path)
+    elif name != None and len(args) > 0:
+        sys.exit( run_command(name,accession,args,report_dir) )
+    else:
+        print("Error: please provide either a stage name and a command or an output path for the merged report.")
+        print(usage_message)
+        sys.exit(1)
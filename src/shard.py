@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# Copyright: NCBI 2026
+import argparse
+import gzip
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+import zlib
+from evidence import EVIDENCE_NAME
+
+# Global variables are depicted in all uppercase
+SHARD_NAME = 'shard_%04d' # Name of the working directory of each shard
+SHARD_ACCESSIONS = 'sra_accessions.txt' # Name of the SRA accessions file inside each shard directory
+RESULT_FORMATS = ['tsv','jsonl'] # Result formats that can be merged line by line
+COUNTS_NAME = 'variant_counts.tsv'
+MATRIX_NAME = 'variant_matrix.tsv'
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+def get_shard(accession,num_shards):
+    '''
+    Returns the shard an accession belongs to. CRC32 is used rather than hash() because the latter is randomized
+    between Python processes, while an accession must land in the same shard on every node and on every rerun.
+    '''
+    return (zlib.crc32(accession.encode('utf-8')) & 0xffffffff) % num_shards
+
+def split_accessions(sra_path,num_shards,output_dir):
+    '''
+    Splits an SRA accessions file into num_shards accessions files, one per shard working directory
+    Inputs
+    - (str) sra_path: path to the SRA accessions file
+    - (int) num_shards: the number of shards
+    - (str) output_dir: directory in which the shard working directories are created
+    Outputs
+    - shard_dirs: the list of shard working directories
+    '''
+    shard_dirs = [os.path.join(output_dir,SHARD_NAME % (i)) for i in range(num_shards)]
+    streams = []
+    for shard_dir in shard_dirs:
+        if not os.path.isdir(shard_dir):
+            os.makedirs(shard_dir)
+        streams.append( open(os.path.join(shard_dir,SHARD_ACCESSIONS),'w') )
+    with open(sra_path,'r') as in_stream:
+        for line in in_stream:
+            accession = line.strip()
+            if len(accession) > 0:
+                streams[ get_shard(accession,num_shards) ].write( "%s\n" % (accession) )
+    for stream in streams:
+        stream.close()
+    return shard_dirs
+
+def run_shards(shard_dirs,reference_dir,threads,procs,jobs,output_format='tsv'):
+    '''
+    Runs psst.sh on each shard as a local process, with at most jobs shards running at once. On a cluster, the
+    same psst.sh command would instead be submitted once per shard directory.
+    Inputs
+    - shard_dirs: the shard working directories created by split_accessions
+    - (str) reference_dir: working directory of a previous run containing the SNP reference
+    - (int) threads: number of threads per Magic-BLAST run
+    - (int) procs: maximum number of Magic-BLAST runs per shard
+    - (int) jobs: maximum number of shards running at once
+    - (str) output_format: format of the shard results
+    Outputs
+    - failed: the list of shard directories whose run failed
+    '''
+    psst = os.path.join(os.path.dirname(SRC),'psst.sh')
+    pending = list(shard_dirs)
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            shard_dir = pending.pop(0)
+            command = [psst,'-r',reference_dir,'-s',os.path.join(shard_dir,SHARD_ACCESSIONS),'-d',shard_dir,\
+                       '-t',str(threads),'-p',str(procs),'-F',output_format,'-S']
+            with open(os.path.join(shard_dir,'psst.log'),'w') as log:
+                running[shard_dir] = subprocess.Popen(command,stdout=log,stderr=subprocess.STDOUT)
+        for shard_dir in list(running):
+            returncode = running[shard_dir].poll()
+            if returncode is not None:
+                del running[shard_dir]
+                if returncode != 0:
+                    failed.append(shard_dir)
+        time.sleep(0.1)
+    return failed
+
+def read_keyed_lines(path,get_key,skip_header):
+    '''
+    Yields (key, line) pairs for each line of a file so that several files can be merged with heapq.merge, which
+    silently gives an unsorted result if any of them is unsorted. A ValueError naming the file is raised instead
+    when a key is smaller than the one before it, e.g. for a shard that was run without psst.sh -S.
+    '''
+    previous_key = None
+    with open(path,'r') as in_stream:
+        if skip_header:
+            next(in_stream,None)
+        for line in in_stream:
+            key = get_key(line)
+            if previous_key is not None and key < previous_key:
+                raise ValueError("%s is not sorted by accession (%s comes after %s); run its shard with -S" % \
+                                 (path,key,previous_key))
+            previous_key = key
+            yield (key,line)
+
+def read_counts(path,num_keys):
+    '''
+    Yields (key, counts) pairs for each line of a TSV file whose first num_keys columns form the key and whose
+    remaining columns are integers, skipping the header
+    '''
+    with open(path,'r') as in_stream:
+        next(in_stream,None)
+        for line in in_stream:
+            tokens = line.rstrip('\n').split('\t')
+            yield ( tuple(tokens[:num_keys]), [int(token) for token in tokens[num_keys:]] )
+
+def get_sra_key(output_format):
+    '''
+    Returns a function that extracts the SRA accession from a result line
+    '''
+    if output_format == 'tsv':
+        return lambda line: line.split('\t',1)[0]
+    return lambda line: json.loads(line)['sra']
+
+def merge_results(paths,output_path,output_format):
+    '''
+    Merges the result files of the shards into a single result file. Shard results written with -S are sorted
+    by accession, so the merged file is sorted as well. Memory use is constant; time is linear in the output.
+    Outputs
+    - (int) the number of SRA datasets in the merged file
+    '''
+    get_key = get_sra_key(output_format)
+    streams = [read_keyed_lines(path,get_key,output_format == 'tsv') for path in paths]
+    num_datasets = 0
+    with open(output_path,'w') as output:
+        if output_format == 'tsv' and len(paths) > 0:
+            with open(paths[0],'r') as first:
+                output.write( first.readline() )
+        for key, line in heapq.merge(*streams):
+            output.write(line)
+            num_datasets += 1
+    return num_datasets
+
+def merge_counts(paths,output_path,num_keys):
+    '''
+    Merges sorted count files, e.g. variant_counts.tsv or variant_matrix.tsv, by summing the counts of equal
+    keys. Since every input is sorted by key, equal keys are adjacent in the merged stream, so memory use is
+    constant and time is linear in the output.
+    '''
+    streams = [read_counts(path,num_keys) for path in paths]
+    with open(output_path,'w') as output:
+        if len(paths) > 0:
+            with open(paths[0],'r') as first:
+                output.write( first.readline() )
+        current_key = None
+        current_counts = None
+        for key, counts in heapq.merge(*streams):
+            if key != current_key:
+                if current_key is not None:
+                    output.write( "\t".join( list(current_key) + [str(c) for c in current_counts] ) + "\n" )
+                current_key = key
+                current_counts = counts
+            else:
+                current_counts = [a + b for a, b in zip(current_counts,counts)]
+        if current_key is not None:
+            output.write( "\t".join( list(current_key) + [str(c) for c in current_counts] ) + "\n" )
+
+def merge_evidence(paths,output_path):
+    '''
+    Concatenates the evidence tables of the shards. Each SRA dataset belongs to exactly one shard, so its rows
+    stay contiguous, as read_evidence in evidence.py expects.
+    '''
+    with gzip.open(output_path,'wt') as output:
+        for i, path in enumerate(paths):
+            with gzip.open(path,'rt') as in_stream:
+                header = next(in_stream,'')
+                if i == 0:
+                    output.write(header)
+                for line in in_stream:
+                    output.write(line)
+
+def merge_shards(shard_dirs,output_dir,output_format='tsv'):
+    '''
+    Combines the results, per-variant counts and variant co-occurrence counts of each shard into cohort files
+    in the output directory. The read evidence tables are combined as well if every shard has one.
+    Outputs
+    - (int) the number of SRA datasets in the cohort
+    '''
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    result_name = 'results.' + output_format
+    for name in [result_name,COUNTS_NAME,MATRIX_NAME]:
+        missing = [shard_dir for shard_dir in shard_dirs if not os.path.exists(os.path.join(shard_dir,name))]
+        if missing:
+            raise IOError("%s is missing from %s" % (name,', '.join(missing)))
+    num_datasets = merge_results( [os.path.join(shard_dir,result_name) for shard_dir in shard_dirs],\
+                                  os.path.join(output_dir,result_name), output_format )
+    merge_counts( [os.path.join(shard_dir,COUNTS_NAME) for shard_dir in shard_dirs],\
+                  os.path.join(output_dir,COUNTS_NAME), 1 )
+    merge_counts( [os.path.join(shard_dir,MATRIX_NAME) for shard_dir in shard_dirs],\
+                  os.path.join(output_dir,MATRIX_NAME), 2 )
+    evidence_paths = [os.path.join(shard_dir,EVIDENCE_NAME) for shard_dir in shard_dirs]
+    if all( [os.path.exists(path) for path in evidence_paths] ):
+        merge_evidence( evidence_paths, os.path.join(output_dir,EVIDENCE_NAME) )
+    return num_datasets
+
+def unit_tests():
+    import shutil
+    import tempfile
+    from call_variants import count_variants, create_variant_matrix, write_variant_counts, write_variant_matrix
+    from result_sink import open_sink, write_result, close_sink
+    variants = {'SRR1':{'heterozygous':['a'],'homozygous':['b']},'SRR2':{'heterozygous':['a','c'],'homozygous':[]},\
+                'SRR3':{'heterozygous':[],'homozygous':['a','b','c']},'SRR4':{'heterozygous':['b'],'homozygous':[]}}
+    directory = tempfile.mkdtemp()
+    try:
+        sra_path = os.path.join(directory,'sra.txt')
+        with open(sra_path,'w') as sra:
+            sra.write( "\n".join(sorted(variants)) + "\n\n" )
+        shard_dirs = split_accessions(sra_path,3,directory)
+        sharded = []
+        for shard_dir in shard_dirs:
+            with open(os.path.join(shard_dir,SHARD_ACCESSIONS),'r') as accessions:
+                shard_variants = dict( [(acc.strip(),variants[acc.strip()]) for acc in accessions] )
+            sharded += list(shard_variants)
+            # What psst.sh -S would have written for this shard
+            sink = open_sink(os.path.join(shard_dir,'results.tsv'),'tsv',sort=True)
+            for sra_acc in shard_variants:
+                write_result(sink,sra_acc,shard_variants[sra_acc])
+            close_sink(sink)
+            write_variant_counts( count_variants(shard_variants), os.path.join(shard_dir,COUNTS_NAME) )
+            write_variant_matrix( create_variant_matrix(shard_variants), os.path.join(shard_dir,MATRIX_NAME) )
+        # Every accession is in exactly one shard, and the split is deterministic
+        assert( sorted(sharded) == sorted(variants) )
+        assert( split_accessions(sra_path,3,directory) == shard_dirs )
+
+        cohort_dir = os.path.join(directory,'cohort')
+        assert( merge_shards(shard_dirs,cohort_dir) == 4 )
+        # A shard result that is not sorted is rejected rather than merged out of order
+        unsorted_path = os.path.join(directory,'unsorted.tsv')
+        with open(unsorted_path,'w') as unsorted:
+            unsorted.write( "SRA\tHeterozygous SNPs\tHomozygous SNPs\nSRR2\ta\t\nSRR1\t\tb\n" )
+        try:
+            merge_results([unsorted_path],os.path.join(directory,'merged.tsv'),'tsv')
+            assert( False )
+        except ValueError as error:
+            assert( unsorted_path in str(error) )
+        # The merged files are identical to those of an unsharded run
+        unsharded_dir = os.path.join(directory,'unsharded')
+        os.makedirs(unsharded_dir)
+        sink = open_sink(os.path.join(unsharded_dir,'results.tsv'),'tsv',sort=True)
+        for sra_acc in variants:
+            write_result(sink,sra_acc,variants[sra_acc])
+        close_sink(sink)
+        write_variant_counts( count_variants(variants), os.path.join(unsharded_dir,COUNTS_NAME) )
+        write_variant_matrix( create_variant_matrix(variants), os.path.join(unsharded_dir,MATRIX_NAME) )
+        for name in ['results.tsv',COUNTS_NAME,MATRIX_NAME]:
+            with open(os.path.join(cohort_dir,name),'r') as merged, \
+                 open(os.path.join(unsharded_dir,name),'r') as expected:
+                assert( merged.read() == expected.read() )
+    finally:
+        shutil.rmtree(directory)
+    print("All unit tests passed!")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+    '''
+    Runs PSST on a large cohort as independent shards. 'split' deterministically splits an SRA accessions file
+    into N shard working directories, each of which can be given to psst.sh on its own node together with a
+    prebuilt SNP reference ('-r'). 'merge' combines the shard results into cohort results. 'run' does all three
+    with the shards running as local processes.
+    ''')
+    parser.add_argument('-t','--test',action='store_true',help='Perform unit tests for this script.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    split_parser = subparsers.add_parser('split',help='Split an SRA accessions file into shards.')
+    split_parser.add_argument('-s','--sra',required=True,help='Path to the SRA accessions file.')
+    split_parser.add_argument('-n','--shards',required=True,type=int,help='Number of shards.')
+    split_parser.add_argument('-d','--dir',required=True,help='Directory in which to create the shard directories.')
+
+    merge_parser = subparsers.add_parser('merge',help='Merge the results of shard working directories.')
+    merge_parser.add_argument('-o','--output',required=True,help='Directory of the cohort results.')
+    merge_parser.add_argument('-F','--format',default='tsv',choices=RESULT_FORMATS,help='Format of the results.')
+    merge_parser.add_argument('shard_dirs',nargs='+',help='Working directories of the shards.')
+
+    run_parser = subparsers.add_parser('run',help='Split, run the shards as local processes and merge.')
+    run_parser.add_argument('-s','--sra',required=True,help='Path to the SRA accessions file.')
+    run_parser.add_argument('-n','--shards',required=True,type=int,help='Number of shards.')
+    run_parser.add_argument('-d','--dir',required=True,help='Working directory of the cohort.')
+    run_parser.add_argument('-r','--reference',required=True,help='Working directory containing the SNP reference.')
+    run_parser.add_argument('-t','--threads',required=True,type=int,help='Number of threads per Magic-BLAST run.')
+    run_parser.add_argument('-p','--procs',required=True,type=int,help='Maximum number of Magic-BLAST runs per shard.')
+    run_parser.add_argument('-j','--jobs',default=1,type=int,help='Maximum number of shards running at once.')
+    run_parser.add_argument('-F','--format',default='tsv',choices=RESULT_FORMATS,help='Format of the results.')
+    args = parser.parse_args()
+
+    if args.test:
+        unit_tests()
+        sys.exit(0)
+
+    if args.command == 'split':
+        for shard_dir in split_accessions(args.sra,args.shards,args.dir):
+            print(shard_dir)
+    elif args.command == 'merge':
+        num_datasets = merge_shards(args.shard_dirs,args.output,args.format)
+        print("Merged %d SRA datasets into %s" % (num_datasets,args.output))
+    elif args.command == 'run':
+        shard_dirs = split_accessions(args.sra,args.shards,args.dir)
+        failed = run_shards(shard_dirs,os.path.abspath(args.reference),args.threads,args.procs,args.jobs,args.format)
+        if failed:
+            print("Error: the following shards failed, see psst.log in each of them:")
+            for shard_dir in failed:
+                print(shard_dir)
+            sys.exit(1)
+        num_datasets = merge_shards(shard_dirs,args.dir,args.format)
+        print("Merged %d SRA datasets into %s" % (num_datasets,args.dir))
+    else:
+        parser.print_help()
@@ -4,55 +4,89 @@
 import getopt
 import sys
 from get_alleles import get_nth_allele
+from run_report import start_stage, end_stage, count
 
-help_message = "Given a file containing lines of the form 'ACCESSION=W[X/Y]Z', this script creates a FASTA file\n" \
-             + "where the header identifiers are 'ACCESSION' and the sequence is the major allele, i.e. 'WXZ'" 
-usage_message = "[-h help and usage] [-i flanking sequence file] [-o output file]"
+def read_flanking_sequences(input_path):
+	'''
+	Reads a file containing lines of the form 'ACCESSION=W[X/Y]Z'
+	Inputs
+	- (str) input_path: path to the flanking sequence file
+	Outputs
+	- flanking_sequences: a list of (accession, sequence) pairs in the order in which they appear in the file
+	'''
+	flanking_sequences = []
+	with open(input_path,'r') as input_stream:
+		for line in input_stream:
+			tokens = line.rstrip().split('=')
+			if len(tokens) == 2:
+				flanking_sequences.append( (tokens[0],tokens[1]) )
+	return flanking_sequences
 
-options = "hi:o:"
+def write_fasta(flanking_sequences,output_path,stage=None):
+	'''
+	Writes the major allele of each flanking sequence into a FASTA file
+	Inputs
+	- flanking_sequences: a list of (accession, sequence) pairs
+	- (str) output_path: path to the output FASTA file
+	- stage: optional run report stage in which the number of sequences written is counted
+	Outputs
+	- accessions: the list of accessions in the order in which they were written. Magic-BLAST labels the
+	              reference sequences by this order; see get_accession_map in call_variants.py.
+	'''
+	accessions = []
+	with open(output_path,'w') as output_stream:
+		for accession, sequence in flanking_sequences:
+			allele = get_nth_allele(sequence,2)
+			output_stream.write( ">%s\n" % (accession) )
+			output_stream.write( "%s\n" % (allele) )
+			accessions.append(accession)
+			if stage is not None:
+				count(stage,'sequences_written')
+	return accessions
 
-try:
-	opts, args = getopt.getopt(sys.argv[1:],options)
-except getopt.GetoptError:
-	print("Error: unable to read command line arguments.")
-	sys.exit(1)
+if __name__ == '__main__':
+	help_message = "Given a file containing lines of the form 'ACCESSION=W[X/Y]Z', this script creates a FASTA file\n" \
+	             + "where the header identifiers are 'ACCESSION' and the sequence is the major allele, i.e. 'WXZ'" 
+	usage_message = "[-h help and usage] [-i flanking sequence file] [-o output file]"
 
-if len(sys.argv) == 1:
-	print(usage_message)
-	sys.exit(0)
+	options = "hi:o:"
 
-input_path = None
-output_path = None
+	try:
+		opts, args = getopt.getopt(sys.argv[1:],options)
+	except getopt.GetoptError:
+		print("Error: unable to read command line arguments.")
+		sys.exit(1)
 
-for opt, arg in opts:
-	if opt == '-h':
-		print(help_message)
+	if len(sys.argv) == 1:
 		print(usage_message)
 		sys.exit(0)
-	elif opt == '-i':
-		input_path = arg
-	elif opt == '-o':
-		output_path = arg
-
-opts_incomplete = False
-
-if input_path == None:
-	print("Error: please provide the path to the input flank file.")
-	opts_incomplete = True
-if output_path == None:
-	print("Error: please provide the path to the output FASTA file.")
-	opts_incomplete = True
-
-if opts_incomplete:
-	print(usage_message)
-	sys.exit(1)
-
-with open(input_path,'r') as input_stream, open(output_path,'w') as output_stream:
-	for line in input_stream:
-		tokens = line.split('=')
-		if len(tokens) == 2:
-			accession = tokens[0]
-			sequence = tokens[1]
-			allele = get_nth_allele(sequence,2)
-			output_stream.write( ">%s\n" % (accession) )
-			output_stream.write( "%s" % (allele) )
+
+	input_path = None
+	output_path = None
+
+	for opt, arg in opts:
+		if opt == '-h':
+			print(help_message)
+			print(usage_message)
+			sys.exit(0)
+		elif opt == '-i':
+			input_path = arg
+		elif opt == '-o':
+			output_path = arg
+
+	opts_incomplete = False
+
+	if input_path == None:
+		print("Error: please provide the path to the input flank file.")
+		opts_incomplete = True
+	if output_path == None:
+		print("Error: please provide the path to the output FASTA file.")
+		opts_incomplete = True
+
+	if opts_incomplete:
+		print(usage_message)
+		sys.exit(1)
+
+	stage = start_stage('var_flanks_to_fasta')
+	write_fasta( read_flanking_sequences(input_path), output_path, stage )
+	end_stage(stage)